@@ -1,28 +1,31 @@
+import copy
+import hashlib
 import os
+import re
 import shutil
+import time
 import typing as t
 from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime
 from datetime import timezone
 from functools import lru_cache
 
-import joblib
-import pandas as pd
 import typer
-import yaml
-from sklearn.base import BaseEstimator
-from sklearn.model_selection import GridSearchCV
-import numpy as np
 
-import data
-import metrics
-import model
+# Heavy dependencies (pandas, sklearn, xgboost, joblib, yaml) and the modules that
+# use them are imported inside the commands so that the CLI starts fast.
+if t.TYPE_CHECKING:
+    from sklearn.base import BaseEstimator
 
 app = typer.Typer()
 
+QUANTILES_FILENAME = "quantiles.joblib"
+
 
-@lru_cache(None)
 def _read_csv(filepath):
+    import pandas as pd
+
     return pd.read_csv(filepath)
 
 
@@ -34,29 +37,129 @@ class CsvDatasetReader:
         return _read_csv(self.filepath)
 
 
+class CsvPredictionWriter:
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._file = None
+
+    def write(self, df):
+        header = self._file is None
+        if header:
+            self._file = open(self.filepath, "w", newline="")
+        df.to_csv(self._file, header=header, index=False)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class ParquetPredictionWriter:
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._writer = None
+
+    def write(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self._writer = pq.ParquetWriter(self.filepath, table.schema)
+        else:
+            table = pa.Table.from_pandas(
+                df, schema=self._writer.schema, preserve_index=False
+            )
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def _get_prediction_writer(filepath: str):
+    if filepath.endswith(".parquet"):
+        return ParquetPredictionWriter(filepath)
+    return CsvPredictionWriter(filepath)
+
+
 def _get_dataset(data_config, splits):
+    import data
+
     filepath = data_config["filepath"]
     years_train = data_config["years_train"]
     reader = CsvDatasetReader(filepath)
-    return data.get_dataset(reader=reader, splits=splits, years_train=years_train)
+    return data.get_dataset(
+        reader=reader,
+        splits=splits,
+        years_train=years_train,
+        key_column=data_config.get("key_column"),
+        n_jobs=data_config.get("jobs", 1),
+    )
 
 
 def _save_versioned_estimator(
-    estimator: BaseEstimator, hyperparams: t.Dict[str, t.Any], output_dir: str
+    estimator: "BaseEstimator",
+    hyperparams: t.Dict[str, t.Any],
+    output_dir: str,
+    lineage: t.Optional[t.Dict[str, t.Any]] = None,
+    training_time: t.Optional[float] = None,
+    variants: t.Optional[t.Dict[str, "BaseEstimator"]] = None,
+    quantile_regressor: t.Optional["BaseEstimator"] = None,
 ):
-    version = str(datetime.now(timezone.utc).replace(second=0, microsecond=0))
-    version = version.replace(':', ' ')
-    model_dir = os.path.join(output_dir, version)
-    os.makedirs(model_dir, exist_ok=True)
+    """
+    Save a new model version. `variants` are alternative forms of the same model
+    (e.g. pruned for latency), saved next to it as `model.<name>.joblib`, and
+    `quantile_regressor` predicts quantiles from the features it encodes, saved
+    as `quantiles.joblib`.
+    """
+    import joblib
+
+    import catalog
+
+    version, model_dir = _make_version_dir(output_dir)
     try:
         joblib.dump(estimator, os.path.join(model_dir, "model.joblib"))
-        _save_yaml(hyperparams, os.path.join(model_dir, "params.yml"))
+        for name, variant in (variants or {}).items():
+            joblib.dump(variant, os.path.join(model_dir, f"model.{name}.joblib"))
+        if quantile_regressor is not None:
+            joblib.dump(quantile_regressor, os.path.join(model_dir, QUANTILES_FILENAME))
+        params = dict(hyperparams)
+        if lineage is not None:
+            params["lineage"] = lineage
+        _save_yaml(params, os.path.join(model_dir, "params.yml"))
+        catalog.register_version(
+            catalog.get_catalog_path(output_dir),
+            version,
+            hyperparams,
+            artifact=os.path.join(version, "model.joblib"),
+            lineage=lineage,
+            data_hash=(lineage or {}).get("data_hash"),
+            training_time=training_time,
+        )
     except Exception as e:
         typer.echo(f"Coudln't serialize model due to error {e}")
         shutil.rmtree(model_dir)
     return version
 
 
+def _make_version_dir(output_dir: str) -> t.Tuple[str, str]:
+    """
+    Create the directory of a new version, named after the current UTC time.
+    Versions created within the same second get a numeric suffix.
+    """
+    base = str(datetime.now(timezone.utc).replace(microsecond=0)).replace(":", " ")
+    os.makedirs(output_dir, exist_ok=True)
+    version, suffix = base, 0
+    while True:
+        model_dir = os.path.join(output_dir, version)
+        try:
+            os.makedirs(model_dir)
+            return version, model_dir
+        except FileExistsError:
+            suffix += 1
+            version = f"{base} {suffix}"
+
+
 def _param_grid_to_sklearn_format(param_grid):
     return {
         f"{name}__{pname}": pvalues
@@ -77,21 +180,26 @@ def _param_grid_to_custom_format(param_grid):
 
 @app.command()
 def train(config_file: str):
+    import data
+    import model
+
     hyperparams = _load_config(config_file, "hyperparams")
+    data_config = _load_config(config_file, "data")
     split = "train"
     (
         dataset,
         shifted_varnames_cnt,
         shifted_varnames_num,
         shifted_varnames_cat,
-    ) = _get_dataset(
-        _load_config(config_file, "data"), splits=[split]
-    )  # [split]
+    ) = _get_dataset(data_config, splits=[split])  # [split]
 
     (X, y) = dataset[split]
 
     model_features, categorical_features, _ = data.aggregate_features(
-        shifted_varnames_cnt, shifted_varnames_num, shifted_varnames_cat
+        shifted_varnames_cnt,
+        shifted_varnames_num,
+        shifted_varnames_cat,
+        key_column=data_config.get("key_column"),
     )
 
     # Add new hyperparams from those established during the feature extraction phase
@@ -100,21 +208,225 @@ def train(config_file: str):
     hyperparams["column_transformer"] = {"categorical_features": categorical_features}
 
     estimator = model.build_estimator(hyperparams)
+    start = time.perf_counter()
     estimator.fit(X, y)
+    training_time = time.perf_counter() - start
+    export_config = _load_config(config_file, "export")
+    output_dir = export_config["output_dir"]
+    variants = _build_variants(estimator, export_config)
+    version = _save_versioned_estimator(
+        estimator,
+        hyperparams,
+        output_dir,
+        lineage=_data_lineage(X, y),
+        training_time=training_time,
+        variants=variants,
+        quantile_regressor=_fit_quantile_regressor(config_file, estimator, X, y),
+    )
+    if variants:
+        metric = _load_config(config_file, "metrics")[0]
+        test_dataset, _, _, _ = _get_dataset(data_config, splits=["test"])
+        X_test, y_test = test_dataset["test"]
+        _save_yaml(
+            _variants_report(estimator, variants, X_test, y_test, metric),
+            os.path.join(output_dir, version, "variants.yml"),
+        )
+    return version
+
+
+def _fit_quantile_regressor(config_file, estimator, X, y):
+    """
+    Quantile model of the `quantiles` config section, None without one. The
+    quantile minimizing the cost of the first metric is always predicted.
+    """
+    import metrics
+    import model
+
+    quantile_config = _load_yaml(config_file).get("quantiles")
+    if quantile_config is None:
+        return None
+    metric = _load_config(config_file, "metrics")[0]
+    return model.fit_quantile_regressor(
+        estimator,
+        X,
+        y,
+        quantile_config["levels"],
+        cost_optimal=metrics.get_cost_optimal_quantile(
+            metric["name"], **metric["params"]
+        ),
+        params=quantile_config.get("params"),
+    )
+
+
+def _build_variants(estimator, export_config) -> t.Dict[str, t.Any]:
+    import model
+
+    variants = {}
+    if export_config.get("pruned") is not None:
+        variants["pruned"] = model.prune_estimator(
+            estimator, export_config["pruned"]["rounds"]
+        )
+    return variants
+
+
+def _variants_report(estimator, variants, X, y, metric) -> t.Dict[str, t.Any]:
+    """
+    Error, latency and size of each variant compared with the original model, on
+    the data given (held-out data, for the error).
+    """
+    import pickle
+
+    import numpy as np
+
+    import metrics
+
+    fn = metrics.get_metric_function(metric["name"], **metric["params"])
+
+    def describe(candidate):
+        y_pred = candidate.predict(X)
+        return {
+            metric["name"]: float(fn(y, y_pred.astype(np.uint32))),
+            "batch_latency": _median_time(lambda: candidate.predict(X)),
+            "row_latency": _median_time(lambda: candidate.predict(X.iloc[:1])),
+            "size": len(pickle.dumps(candidate)),
+        }, y_pred
+
+    original, y_original = describe(estimator)
+    report = {"model": original, "rows": len(X)}
+    for name, variant in variants.items():
+        description, y_pred = describe(variant)
+        description["max_abs_prediction_delta"] = float(
+            np.max(np.abs(y_pred - y_original), initial=0)
+        )
+        for key in (metric["name"], "batch_latency", "row_latency", "size"):
+            description[f"{key} ratio"] = description[key] / original[key]
+        report[name] = description
+    return report
+
+
+def _median_time(fn: t.Callable[[], t.Any], repeat: int = 5) -> float:
+    import statistics
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+@app.command()
+def update(
+    config_file: str,
+    model_version: str,
+    rounds: t.Optional[int] = typer.Option(None),
+    since: t.Optional[str] = typer.Option(None),
+):
+    """
+    Continue boosting an existing model version using only the hours recorded
+    after the data it was trained on.
+    """
+    import joblib
+    import pandas as pd
+
+    import data
+    import model
+
+    update_config = _load_config(config_file, "update")
+    if rounds is None:
+        rounds = update_config["rounds"]
     output_dir = _load_config(config_file, "export")["output_dir"]
-    version = _save_versioned_estimator(estimator, hyperparams, output_dir)
+    model_dir = os.path.join(output_dir, model_version)
+    base_estimator = joblib.load(os.path.join(model_dir, "model.joblib"))
+    hyperparams = copy.deepcopy(_load_yaml(os.path.join(model_dir, "params.yml")))
+    lineage = hyperparams.pop("lineage", {})
+
+    if since is None:
+        since = lineage.get("data_end")
+    if since is None:
+        typer.echo(f"Model {model_version} has no recorded data end, pass --since")
+        raise typer.Exit(code=1)
+
+    data_config = _load_config(config_file, "data")
+    reader = CsvDatasetReader(data_config["filepath"])
+    (X, y), _, _, _ = data.get_incremental_dataset(
+        reader=reader,
+        since=pd.Timestamp(since),
+        history_hours=update_config.get("history_hours", data.LAG_HISTORY_HOURS),
+        key_column=data_config.get("key_column"),
+        n_jobs=data_config.get("jobs", 1),
+    )
+    if len(X) == 0:
+        typer.echo(f"No new data after {since}")
+        raise typer.Exit(code=1)
+
+    start = time.perf_counter()
+    estimator = model.continue_training(base_estimator, X, y, rounds)
+    training_time = time.perf_counter() - start
+    hyperparams["regressor"]["n_estimators"] = (
+        hyperparams["regressor"].get("n_estimators", 0) + rounds
+    )
+    new_lineage = _data_lineage(X, y)
+    new_lineage.update(
+        {
+            "base_version": model_version,
+            "rounds": rounds,
+            "rows": len(X),
+            "history": lineage,
+        }
+    )
+    version = _save_versioned_estimator(
+        estimator,
+        hyperparams,
+        output_dir,
+        lineage=new_lineage,
+        training_time=training_time,
+    )
     return version
 
 
+def _data_lineage(X, y) -> t.Dict[str, t.Any]:
+    return {
+        "data_start": str(X.index.min()),
+        "data_end": str(X.index.max()),
+        "data_hash": _data_hash(X, y),
+    }
+
+
+def _data_hash(X, y) -> str:
+    import pandas as pd
+
+    digest = hashlib.sha1(pd.util.hash_pandas_object(X).to_numpy())
+    digest.update(pd.util.hash_pandas_object(y).to_numpy())
+    digest.update(",".join(map(str, X.columns)).encode())
+    return digest.hexdigest()
+
+
 @app.command()
 def find_hyperparams(
     config_file: str,
     train_best_model: bool = typer.Argument(False),
 ):
+    """
+    Grid search the hyperparameters and save the best model. Every fold's
+    result is recorded in the catalog as it finishes, and fits already recorded
+    for the same data, metric and folds are not run again, so interrupted or
+    widened searches pick up where they stopped.
+    """
+    from sklearn.base import clone
+
+    import catalog
+    import data
+    import metrics
+    import model
+    import search
+
     search_config = _load_config(config_file, "search")
     param_grid = search_config["grid"]
     n_jobs = search_config["jobs"]
+    folds = search_config.get("folds", 5)
     metric = _load_config(config_file, "metrics")[0]
+    data_config = _load_config(config_file, "data")
 
     split = "train"
     (
@@ -122,12 +434,15 @@ def find_hyperparams(
         shifted_varnames_cnt,
         shifted_varnames_num,
         shifted_varnames_cat,
-    ) = _get_dataset(_load_config(config_file, "data"), splits=[split])
+    ) = _get_dataset(data_config, splits=[split])
 
     (X, y) = dataset[split]
 
     model_features, categorical_features, _ = data.aggregate_features(
-        shifted_varnames_cnt, shifted_varnames_num, shifted_varnames_cat
+        shifted_varnames_cnt,
+        shifted_varnames_num,
+        shifted_varnames_cat,
+        key_column=data_config.get("key_column"),
     )
 
     dummy_hyperparams = {name: {} for name in param_grid.keys()}
@@ -138,19 +453,164 @@ def find_hyperparams(
 
     estimator = model.build_estimator(dummy_hyperparams)
     scoring = metrics.get_scoring_function(metric["name"], **metric["params"])
-    gs = GridSearchCV(
+    candidates = search.get_candidates(_param_grid_to_sklearn_format(param_grid))
+
+    output_dir = _load_config(config_file, "export")["output_dir"]
+    os.makedirs(output_dir, exist_ok=True)
+    catalog_path = catalog.get_catalog_path(output_dir)
+    lineage = _data_lineage(X, y)
+    search_key = (lineage["data_hash"], _scoring_key(metric), folds)
+    results = catalog.get_search_results(catalog_path, *search_key)
+    keys = {catalog.params_key(params) for params in candidates}
+    completed = {
+        (catalog.params_key(r["params"]), r["fold"])
+        for r in results
+        if catalog.params_key(r["params"]) in keys
+    }
+    typer.echo(
+        f"{len(candidates)} candidates x {folds} folds, "
+        f"{len(completed)} fits already recorded"
+    )
+    # Without fits left, workers would wait for tasks that never come
+    pending = len(candidates) * folds - len(completed)
+    distributed_config = search_config.get("distributed") if pending else None
+    with _search_server(distributed_config) as server:
+        for result in search.iter_fold_results(
+            estimator, candidates, X, y, scoring, folds, n_jobs, completed, server
+        ):
+            catalog.register_search_result(catalog_path, *search_key, **result)
+            results.append(result)
+            typer.echo(
+                f"[CV {result['fold'] + 1}/{folds}] {result['params']}; "
+                f"score={result['score']:.3f}; fit_time={result['fit_time']:.1f}s"
+            )
+
+    summary = search.summarize(
+        [r for r in results if catalog.params_key(r["params"]) in keys], folds
+    )
+    best_params = summary[0]["params"]
+    estimator = clone(estimator).set_params(**best_params)
+    start = time.perf_counter()
+    estimator.fit(X, y)
+    training_time = time.perf_counter() - start
+    hyperparams = _param_grid_to_custom_format(best_params)
+    _save_versioned_estimator(
         estimator,
-        _param_grid_to_sklearn_format(param_grid),
-        n_jobs=n_jobs,
-        scoring=scoring,
-        verbose=3,
+        hyperparams,
+        output_dir,
+        lineage=lineage,
+        training_time=training_time,
     )
 
-    gs.fit(X, y)
-    hyperparams = _param_grid_to_custom_format(gs.best_params_)
-    estimator = gs.best_estimator_ # model.build_estimator(hyperparams)
+
+@app.command()
+def search_report(config_file: str, all_candidates: bool = False):
+    """
+    Score against fit time of the candidates searched on the current training
+    data, from the catalog. Only those in the configured grid are shown unless
+    --all-candidates is given. `efficient` candidates are those no cheaper
+    candidate scores as well.
+    """
+    import catalog
+    import search
+
+    search_config = _load_config(config_file, "search")
+    folds = search_config.get("folds", 5)
+    metric = _load_config(config_file, "metrics")[0]
+    dataset, _, _, _ = _get_dataset(_load_config(config_file, "data"), splits=["train"])
+    X, y = dataset["train"]
     output_dir = _load_config(config_file, "export")["output_dir"]
-    _save_versioned_estimator(estimator, hyperparams, output_dir)
+    results = catalog.get_search_results(
+        catalog.get_catalog_path(output_dir),
+        _data_hash(X, y),
+        _scoring_key(metric),
+        folds,
+    )
+    if not all_candidates:
+        candidates = search.get_candidates(
+            _param_grid_to_sklearn_format(search_config["grid"])
+        )
+        keys = {catalog.params_key(params) for params in candidates}
+        results = [r for r in results if catalog.params_key(r["params"]) in keys]
+    summary = search.summarize(results, folds)
+
+    for entry in summary:
+        typer.echo(
+            f"{entry['rank']:>4} {entry['mean_score']:>9.4f} "
+            f"(+/- {entry['std_score']:.4f}) {entry['mean_fit_time']:>7.2f}s "
+            f"{entry['folds']}/{folds} folds {'*' if entry['efficient'] else ' '} "
+            f"{entry['params']}"
+        )
+    reports_dir = _load_config(config_file, "reports")["dir"]
+    _save_yaml(
+        {"metric": metric["name"], "folds": folds, "candidates": summary},
+        os.path.join(reports_dir, "search.yml"),
+    )
+
+
+@contextmanager
+def _search_server(distributed_config: t.Optional[t.Dict[str, t.Any]]):
+    """
+    Server handing the fits out to search workers, None to run them locally. The
+    workers authenticate with the SEARCH_AUTHKEY environment variable, which may be
+    left unset when all of them are local.
+    """
+    if distributed_config is None:
+        yield None
+        return
+
+    import multiprocessing
+    import secrets
+
+    import cluster
+
+    local_workers = distributed_config.get("local_workers", 0)
+    authkey = os.environ.get("SEARCH_AUTHKEY")
+    if authkey is None:
+        if not local_workers:
+            raise typer.BadParameter("Set SEARCH_AUTHKEY to accept search workers")
+        authkey = secrets.token_hex(16)
+    with cluster.TaskServer(
+        cluster.parse_address(distributed_config["address"]),
+        authkey.encode(),
+        task_timeout=distributed_config.get("task_timeout"),
+    ) as server:
+        typer.echo(f"Accepting search workers on {server.address}")
+        workers = [
+            multiprocessing.Process(
+                target=cluster.run_worker,
+                args=(server.address, authkey.encode()),
+                daemon=True,
+            )
+            for _ in range(local_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        yield server
+    for worker in workers:
+        worker.join()
+
+
+@app.command()
+def search_worker(address: str, connect_timeout: float = 60):
+    """
+    Run fits for the hyperparameter search accepting workers on ADDRESS
+    (HOST:PORT, see `search.distributed` in the config) until it is over. Set
+    SEARCH_AUTHKEY as for the search.
+    """
+    import cluster
+
+    authkey = os.environ.get("SEARCH_AUTHKEY")
+    if authkey is None:
+        raise typer.BadParameter("Set SEARCH_AUTHKEY as for the search")
+    cluster.run_worker(
+        cluster.parse_address(address), authkey.encode(), connect_timeout
+    )
+
+
+def _scoring_key(metric: t.Dict[str, t.Any]) -> str:
+    params = ",".join(f"{k}={v}" for k, v in sorted(metric["params"].items()))
+    return f"{metric['name']}({params})"
 
 
 @app.command()
@@ -158,6 +618,13 @@ def eval(config_file: str,
     model_version: str,
     splits: t.List[str] = ["train","test"],
 ):
+    import joblib
+    import numpy as np
+
+    import catalog
+    import metrics
+    import model
+
     output_dir = _load_config(config_file, "export")["output_dir"]
     saved_model = os.path.join(output_dir, model_version, "model.joblib")
     estimator = joblib.load(saved_model)
@@ -168,20 +635,287 @@ def eval(config_file: str,
         _,
     ) = _get_dataset(_load_config(config_file, "data"), splits=splits)
 
+    quantiles_path = os.path.join(output_dir, model_version, QUANTILES_FILENAME)
+    quantile_regressor = (
+        joblib.load(quantiles_path) if os.path.exists(quantiles_path) else None
+    )
+
     report = defaultdict(list)
+    # Shares of rows rather than errors, reported but not ranked in the catalog
+    diagnostics = defaultdict(list)
     all_metrics = _load_config(config_file, "metrics")
     for name, (X, y) in dataset.items():
-        y_pred = (estimator.predict(X)).astype(np.uint32)
+        if quantile_regressor is None:
+            y_pred = (estimator.predict(X)).astype(np.uint32)
+        else:
+            y_pred, y_quantiles = model.predict_quantiles(
+                estimator, quantile_regressor, X
+            )
+            y_pred = y_pred.astype(np.uint32)
+            levels = quantile_regressor.quantiles_
+            # Share of the counts below each predicted quantile, ideally its level
+            for level, y_quantile in zip(levels, y_quantiles.T):
+                value = float(np.mean(y <= y_quantile))
+                diagnostics[f"coverage q{level:g}"].append(
+                    {"split": name, "value": value}
+                )
+            y_optimal = y_quantiles[:, quantile_regressor.cost_optimal_index_]
+            outside = (y_pred < y_quantiles[:, 0]) | (y_pred > y_quantiles[:, -1])
+            diagnostics["point outside quantiles"].append(
+                {"split": name, "value": float(np.mean(outside))}
+            )
         for m in all_metrics:
             metric_name, params = m["name"], m["params"]
             fn = metrics.get_metric_function(metric_name, **params)
             value = float(fn(y, y_pred))
             report[metric_name].append({"split": name, "value": value})
+            if quantile_regressor is not None:
+                value = float(fn(y, y_optimal.astype(np.uint32)))
+                report[f"{metric_name} (cost-optimal quantile)"].append(
+                    {"split": name, "value": value}
+                )
     reports_dir = _load_config(config_file, "reports")["dir"]
     _save_yaml(
-        dict(report),
+        {**report, **diagnostics},
         os.path.join(reports_dir, f"{model_version}.yml"),
     )
+    catalog.register_metrics(
+        catalog.get_catalog_path(output_dir), model_version, dict(report)
+    )
+
+
+@app.command()
+def score(
+    config_file: str,
+    model_version: str,
+    input_file: str,
+    output_file: str,
+    chunk_size: t.Optional[int] = typer.Option(None),
+    jobs: t.Optional[int] = typer.Option(None),
+):
+    """
+    Predict a raw (time-sorted) dataset in chunks of rows, writing the predictions
+    to a CSV or Parquet file as they are computed.
+    """
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    import joblib
+    import pandas as pd
+
+    import data
+    import model
+
+    score_config = _load_config(config_file, "score")
+    chunk_size = chunk_size or score_config["chunk_size"]
+    jobs = jobs or score_config["jobs"]
+    key_column = _load_config(config_file, "data").get("key_column")
+    output_dir = _load_config(config_file, "export")["output_dir"]
+    estimator = joblib.load(os.path.join(output_dir, model_version, "model.joblib"))
+    predictor = model.ChunkPredictor(estimator)
+
+    chunks = data.iter_dataset_chunks(
+        pd.read_csv(input_file, chunksize=chunk_size), key_column=key_column
+    )
+    writer = _get_prediction_writer(output_file)
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            # At most `jobs` chunks are predicted at once, keeping memory bounded
+            in_flight: t.Deque[t.Any] = deque()
+            for X, y in chunks:
+                in_flight.append((X, y, pool.submit(predictor, X)))
+                if len(in_flight) >= jobs:
+                    writer.write(_predictions_frame(*in_flight.popleft(), key_column))
+            while in_flight:
+                writer.write(_predictions_frame(*in_flight.popleft(), key_column))
+    finally:
+        writer.close()
+
+
+def _predictions_frame(X, y, prediction, key_column=None):
+    import numpy as np
+    import pandas as pd
+
+    columns = {"datetime": X.index}
+    if key_column is not None:
+        columns[key_column] = X[key_column].to_numpy()
+    columns["cnt"] = y.to_numpy()
+    columns["prediction"] = prediction.result().astype(np.uint32)
+    return pd.DataFrame(columns)
+
+
+@app.command()
+def monitor(
+    config_file: str,
+    model_version: str,
+    log_file: t.Optional[str] = typer.Option(None, help="Prediction log"),
+):
+    """
+    Update the monitoring statistics of a served model with the predictions
+    logged and the counts added to the dataset since the last run, and report
+    whether it should be retrained.
+    """
+    import joblib
+    import numpy as np
+
+    import metrics
+    import monitor as monitoring
+
+    monitor_config = _load_config(config_file, "monitor")
+    data_config = _load_config(config_file, "data")
+    key_column = data_config.get("key_column")
+    metric = _load_config(config_file, "metrics")[0]
+    error_fn = metrics.get_metric_function(metric["name"], **metric["params"])
+    reports_dir = _load_config(config_file, "reports")["dir"]
+    state_path = os.path.join(reports_dir, f"{model_version}.monitor.json")
+
+    if os.path.exists(state_path):
+        monitor_ = monitoring.Monitor.load(state_path)
+    else:
+        # The model's error on the test split is the reference for the rolling
+        # error, and the training data for the feature distributions
+        output_dir = _load_config(config_file, "export")["output_dir"]
+        estimator = joblib.load(os.path.join(output_dir, model_version, "model.joblib"))
+        dataset, _, _, _ = _get_dataset(data_config, splits=["train", "test"])
+        X_test, y_test = dataset["test"]
+        reference_error = error_fn(y_test, estimator.predict(X_test).astype(np.uint32))
+        X_train, _ = dataset["train"]
+        if key_column is not None:
+            X_train = X_train.drop(columns=key_column)
+        monitor_ = monitoring.Monitor.create(
+            X_train,
+            float(reference_error),
+            bins=monitor_config["bins"],
+            half_life=monitor_config["half_life"],
+            max_pending_hours=monitor_config["max_pending_hours"],
+        )
+
+    monitor_.update(
+        log_file or monitor_config["log_file"],
+        data_config["filepath"],
+        key_column,
+        error_fn,
+    )
+    os.makedirs(reports_dir, exist_ok=True)
+    monitor_.save(state_path)
+    report = monitor_.report(
+        error_tolerance=monitor_config["error_tolerance"],
+        drift_threshold=monitor_config["drift_threshold"],
+        min_samples=monitor_config["min_samples"],
+    )
+    _save_yaml(report, os.path.join(reports_dir, f"{model_version}.monitor.yml"))
+    error = "-" if report["error"] is None else f"{report['error']:.3f}"
+    typer.echo(
+        f"{report['logged']} predictions logged, {report['joined']} with counts "
+        f"(error {error}, reference {report['reference_error']:.3f})"
+    )
+    typer.echo(
+        "retrain: " + ("; ".join(report["reasons"]) if report["retrain"] else "no")
+    )
+
+
+@app.command()
+def list_versions(
+    config_file: str,
+    metric: t.Optional[str] = typer.Option(None),
+    split: str = typer.Option("test"),
+):
+    """
+    List the catalogued model versions, best first when a metric is given.
+    """
+    import catalog
+
+    output_dir = _load_config(config_file, "export")["output_dir"]
+    records = catalog.list_versions(
+        catalog.get_catalog_path(output_dir), metric=metric, split=split
+    )
+    for record in records:
+        value = "" if record["value"] is None else f"\t{record['value']:.4f}"
+        typer.echo(f"{record['version']}\t{record['artifact_size']}{value}")
+
+
+@app.command()
+def show_version(config_file: str, model_version: str):
+    """Print everything the catalog knows about a model version."""
+    import catalog
+
+    output_dir = _load_config(config_file, "export")["output_dir"]
+    record = catalog.get_version(catalog.get_catalog_path(output_dir), model_version)
+    if record is None:
+        typer.echo(f"Model {model_version} is not in the catalog")
+        raise typer.Exit(code=1)
+    _dump_yaml(record)
+
+
+@app.command()
+def best_version(
+    config_file: str,
+    metric: t.Optional[str] = typer.Option(None),
+    split: str = typer.Option("test"),
+):
+    """
+    Print the version with the lowest error, by default on the first configured
+    metric.
+    """
+    import catalog
+
+    output_dir = _load_config(config_file, "export")["output_dir"]
+    metric = metric or _load_config(config_file, "metrics")[0]["name"]
+    record = catalog.get_best_version(
+        catalog.get_catalog_path(output_dir), metric, split=split
+    )
+    if record is None:
+        typer.echo(f"No version has been evaluated on {metric} ({split})")
+        raise typer.Exit(code=1)
+    typer.echo(record["version"])
+
+
+@app.command()
+def sync_catalog(config_file: str):
+    """
+    Add the versions and reports found on disk that are missing from the catalog,
+    e.g. those saved before the catalog existed.
+    """
+    import catalog
+
+    output_dir = _load_config(config_file, "export")["output_dir"]
+    reports_dir = _load_config(config_file, "reports")["dir"]
+    catalog_path = catalog.get_catalog_path(output_dir)
+    for version in sorted(os.listdir(output_dir)):
+        artifact = os.path.join(version, "model.joblib")
+        if not os.path.isfile(os.path.join(output_dir, artifact)):
+            continue
+        if catalog.get_version(catalog_path, version) is None:
+            hyperparams = copy.deepcopy(
+                _load_yaml(os.path.join(output_dir, version, "params.yml"))
+            )
+            lineage = hyperparams.pop("lineage", None)
+            catalog.register_version(
+                catalog_path,
+                version,
+                hyperparams,
+                artifact=artifact,
+                lineage=lineage,
+                data_hash=(lineage or {}).get("data_hash"),
+                created_at=_version_created_at(output_dir, version),
+            )
+        report_path = os.path.join(reports_dir, f"{version}.yml")
+        if os.path.isfile(report_path):
+            catalog.register_metrics(catalog_path, version, _load_yaml(report_path))
+
+
+def _version_created_at(output_dir: str, version: str) -> datetime:
+    """
+    When a version was saved, from its name (see `_make_version_dir`) or else from
+    the modification time of its artifact.
+    """
+    match = re.fullmatch(r"(\d{4}-\d\d-\d\d \d\d \d\d \d\d)\+00 00( \d+)?", version)
+    if match is not None:
+        return datetime.strptime(match.group(1), "%Y-%m-%d %H %M %S").replace(
+            tzinfo=timezone.utc
+        )
+    mtime = os.path.getmtime(os.path.join(output_dir, version, "model.joblib"))
+    return datetime.fromtimestamp(mtime, timezone.utc)
 
 
 def _load_config(filepath: str, key: str):
@@ -192,15 +926,25 @@ def _load_config(filepath: str, key: str):
 
 @lru_cache(None)
 def _load_yaml(filepath: str) -> t.Dict[str, t.Any]:
+    import yaml
+
     with open(filepath, "r") as f:
         content = yaml.load(f)
     return content
 
 
 def _save_yaml(content: t.Dict[str, t.Any], filepath: str):
+    import yaml
+
     with open(filepath, "w") as f:
         yaml.dump(content, f)
 
 
+def _dump_yaml(content: t.Dict[str, t.Any]):
+    import yaml
+
+    typer.echo(yaml.dump(content))
+
+
 if __name__ == "__main__":
     app()
@@ -0,0 +1,212 @@
+import json
+import os
+import sqlite3
+import typing as t
+from contextlib import closing
+from datetime import datetime
+from datetime import timezone
+
+CATALOG_FILENAME = "catalog.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    version TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    hyperparams TEXT NOT NULL,
+    lineage TEXT,
+    data_hash TEXT,
+    artifact TEXT NOT NULL,
+    artifact_size INTEGER,
+    training_time REAL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    version TEXT NOT NULL REFERENCES versions(version),
+    metric TEXT NOT NULL,
+    split TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (version, metric, split)
+);
+CREATE INDEX IF NOT EXISTS metrics_by_value ON metrics (metric, split, value);
+CREATE TABLE IF NOT EXISTS search_results (
+    data_hash TEXT NOT NULL,
+    scoring TEXT NOT NULL,
+    folds INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    fold INTEGER NOT NULL,
+    score REAL NOT NULL,
+    fit_time REAL NOT NULL,
+    score_time REAL NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (data_hash, scoring, folds, params, fold)
+);
+"""
+
+
+def get_catalog_path(output_dir: str) -> str:
+    """The catalog lives next to the model versions it indexes."""
+    return os.path.join(output_dir, CATALOG_FILENAME)
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def register_version(
+    path: str,
+    version: str,
+    hyperparams: t.Dict[str, t.Any],
+    artifact: str,
+    lineage: t.Optional[t.Dict[str, t.Any]] = None,
+    data_hash: t.Optional[str] = None,
+    training_time: t.Optional[float] = None,
+    created_at: t.Optional[datetime] = None,
+):
+    """
+    Record a saved model version. `artifact` is relative to the catalog directory.
+    `created_at` defaults to now.
+    """
+    artifact_size = os.path.getsize(os.path.join(os.path.dirname(path), artifact))
+    with closing(_connect(path)) as connection, connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                version,
+                str(created_at or datetime.now(timezone.utc)),
+                json.dumps(hyperparams),
+                json.dumps(lineage) if lineage is not None else None,
+                data_hash,
+                artifact,
+                artifact_size,
+                training_time,
+            ),
+        )
+
+
+def register_metrics(
+    path: str, version: str, report: t.Dict[str, t.List[t.Dict[str, t.Any]]]
+):
+    """Record an evaluation report, as produced by the `eval` command."""
+    rows = [
+        (version, metric, entry["split"], entry["value"])
+        for metric, entries in report.items()
+        for entry in entries
+    ]
+    with closing(_connect(path)) as connection, connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?)", rows
+        )
+
+
+def list_versions(
+    path: str, metric: t.Optional[str] = None, split: str = "test"
+) -> t.List[t.Dict[str, t.Any]]:
+    """
+    List the catalogued versions, oldest first, or best first when a metric is
+    given (versions not evaluated on it are left out).
+    """
+    with closing(_connect(path)) as connection:
+        if metric is None:
+            rows = connection.execute(
+                "SELECT *, NULL AS value FROM versions ORDER BY created_at"
+            )
+        else:
+            rows = connection.execute(
+                "SELECT versions.*, metrics.value FROM versions"
+                " JOIN metrics USING (version)"
+                " WHERE metrics.metric = ? AND metrics.split = ?"
+                " ORDER BY metrics.value",
+                (metric, split),
+            )
+        return [_to_record(row) for row in rows]
+
+
+def get_version(path: str, version: str) -> t.Optional[t.Dict[str, t.Any]]:
+    with closing(_connect(path)) as connection:
+        row = connection.execute(
+            "SELECT *, NULL AS value FROM versions WHERE version = ?", (version,)
+        ).fetchone()
+        if row is None:
+            return None
+        record = _to_record(row)
+        record["metrics"] = [
+            dict(metric_row)
+            for metric_row in connection.execute(
+                "SELECT metric, split, value FROM metrics WHERE version = ?",
+                (version,),
+            )
+        ]
+        return record
+
+
+def get_best_version(
+    path: str, metric: str, split: str = "test"
+) -> t.Optional[t.Dict[str, t.Any]]:
+    """Version with the lowest value of `metric` (an error) on `split`."""
+    with closing(_connect(path)) as connection:
+        row = connection.execute(
+            "SELECT versions.*, metrics.value FROM versions"
+            " JOIN metrics USING (version)"
+            " WHERE metrics.metric = ? AND metrics.split = ?"
+            " ORDER BY metrics.value LIMIT 1",
+            (metric, split),
+        ).fetchone()
+    return _to_record(row) if row is not None else None
+
+
+def register_search_result(
+    path: str,
+    data_hash: str,
+    scoring: str,
+    folds: int,
+    params: t.Dict[str, t.Any],
+    fold: int,
+    score: float,
+    fit_time: float,
+    score_time: float,
+):
+    """Record the score of a hyperparameter candidate on one cross-validation fold."""
+    with closing(_connect(path)) as connection, connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO search_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                data_hash,
+                scoring,
+                folds,
+                params_key(params),
+                fold,
+                score,
+                fit_time,
+                score_time,
+                str(datetime.now(timezone.utc)),
+            ),
+        )
+
+
+def get_search_results(
+    path: str, data_hash: str, scoring: str, folds: int
+) -> t.List[t.Dict[str, t.Any]]:
+    """Fold scores recorded for the same data, scoring and number of folds."""
+    with closing(_connect(path)) as connection:
+        rows = connection.execute(
+            "SELECT params, fold, score, fit_time, score_time FROM search_results"
+            " WHERE data_hash = ? AND scoring = ? AND folds = ?"
+            " ORDER BY created_at",
+            (data_hash, scoring, folds),
+        )
+        return [{**dict(row), "params": json.loads(row["params"])} for row in rows]
+
+
+def params_key(params: t.Dict[str, t.Any]) -> str:
+    """Canonical form of a candidate, the same whatever the order of the grid."""
+    return json.dumps(params, sort_keys=True)
+
+
+def _to_record(row: sqlite3.Row) -> t.Dict[str, t.Any]:
+    record = dict(row)
+    record["hyperparams"] = json.loads(record["hyperparams"])
+    if record["lineage"] is not None:
+        record["lineage"] = json.loads(record["lineage"])
+    return record
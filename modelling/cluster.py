@@ -0,0 +1,184 @@
+"""
+Run tasks on worker processes, possibly on other machines, that connect over TCP:
+
+    # on the machine running the search
+    SEARCH_AUTHKEY=... python modelling/app.py find-hyperparams config.yml
+    # on each worker machine, with the same code and libraries
+    SEARCH_AUTHKEY=... python modelling/app.py search-worker HOST:PORT
+
+The data shared by all the tasks is sent once to each worker as it connects,
+then tasks are handed out one at a time. Workers can join at any point, and the
+task of a worker that disconnects (or exceeds the task timeout) goes back to the
+queue for another worker.
+"""
+
+import logging
+import pickle
+import queue
+import threading
+import time
+import traceback
+import typing as t
+from multiprocessing.connection import Client
+from multiprocessing.connection import Connection
+from multiprocessing.connection import Listener
+
+logger = logging.getLogger(__name__)
+
+_POLL_INTERVAL = 0.5
+
+
+def parse_address(address: str) -> t.Tuple[str, int]:
+    host, port = address.rsplit(":", maxsplit=1)
+    return host, int(port)
+
+
+class TaskServer:
+    """
+    Hands tasks out to the workers connected to `address` (host, port); connections
+    are authenticated with `authkey`, which must be kept secret as tasks are
+    pickled.
+    """
+
+    def __init__(
+        self,
+        address: t.Tuple[str, int],
+        authkey: bytes,
+        task_timeout: t.Optional[float] = None,
+    ):
+        self.task_timeout = task_timeout
+        self._listener = Listener(address, authkey=authkey)
+        self.address = self._listener.address
+        self._setup: t.Optional[bytes] = None
+        self._tasks: "queue.Queue[t.Tuple[int, t.Any]]" = queue.Queue()
+        self._results: "queue.Queue[t.Tuple[str, int, t.Any]]" = queue.Queue()
+        self._done = threading.Event()
+        self._ready = threading.Event()
+        self._handlers: t.List[threading.Thread] = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def run(
+        self, fn: t.Callable, shared: t.Tuple, tasks: t.List[t.Tuple]
+    ) -> t.Iterator[t.Any]:
+        """
+        Yield `fn(*shared, *task)` for each task, in the order they finish.
+        """
+        self._setup = pickle.dumps(("setup", fn, shared))
+        for task_id, task in enumerate(tasks):
+            self._tasks.put((task_id, task))
+        self._ready.set()
+
+        finished = set()
+        while len(finished) < len(tasks):
+            kind, task_id, payload = self._results.get()
+            if kind == "error":
+                raise RuntimeError(
+                    f"Task {tasks[task_id]} failed on a worker:\n{payload}"
+                )
+            if task_id not in finished:
+                finished.add(task_id)
+                yield payload
+
+    def close(self):
+        self._done.set()
+        self._listener.close()
+        # Let the workers waiting for a task, or for tasks to be run at all, know
+        # that there are no more
+        self._ready.set()
+        for handler in self._handlers:
+            handler.join(timeout=2 * _POLL_INTERVAL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _accept(self):
+        while not self._done.is_set():
+            try:
+                connection = self._listener.accept()
+            except (OSError, EOFError):
+                # Closed listener, or a client that failed to authenticate
+                continue
+            handler = threading.Thread(
+                target=self._serve, args=(connection,), daemon=True
+            )
+            handler.start()
+            self._handlers.append(handler)
+
+    def _serve(self, connection: Connection):
+        self._ready.wait()
+        task = None
+        try:
+            if self._setup is None:
+                # Closed without running any task
+                connection.send(("stop",))
+                return
+            connection.send_bytes(self._setup)
+            while True:
+                task = self._next_task()
+                if task is None:
+                    connection.send(("stop",))
+                    return
+                connection.send(("task",) + task)
+                if not self._wait(connection):
+                    raise TimeoutError(f"no result after {self.task_timeout}s")
+                self._results.put(connection.recv())
+                task = None
+        except (OSError, EOFError, TimeoutError) as e:
+            logger.warning("Lost a search worker: %r", e)
+            if task is not None:
+                self._tasks.put(task)
+        finally:
+            connection.close()
+
+    def _next_task(self) -> t.Optional[t.Tuple[int, t.Any]]:
+        while not self._done.is_set():
+            try:
+                return self._tasks.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return None
+
+    def _wait(self, connection: Connection) -> bool:
+        start = time.monotonic()
+        while not connection.poll(_POLL_INTERVAL):
+            if self._done.is_set():
+                raise EOFError("server closed")
+            if self.task_timeout and time.monotonic() - start > self.task_timeout:
+                return False
+        return True
+
+
+def run_worker(address: t.Tuple[str, int], authkey: bytes, connect_timeout: float = 60):
+    """Run tasks from the server at `address` until it has none left."""
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            connection = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(1)
+
+    with connection:
+        try:
+            message = connection.recv()
+            if message[0] == "stop":
+                return
+            _, fn, shared = message
+            while True:
+                message = connection.recv()
+                if message[0] == "stop":
+                    return
+                _, task_id, task = message
+                try:
+                    result = ("result", task_id, fn(*shared, *task))
+                except Exception:
+                    result = ("error", task_id, traceback.format_exc())
+                connection.send(result)
+        except EOFError:
+            # The server stopped, e.g. interrupted
+            return
@@ -1,5 +1,10 @@
 import datetime
+import functools
 import typing as t
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
 import pandas as pd
 import typing_extensions as te
 
@@ -12,28 +17,233 @@ class DatasetReader(te.Protocol):
 
 SplitName = te.Literal["train", "test"]
 
+# Longest lag used by the expanded features (`cnt_7_days`, `holiday_7_days`, ...)
+LAG_HISTORY_HOURS = 24 * 7
+
+# Keyed inputs with at least this many rows are processed across a process pool
+PARALLEL_MIN_ROWS = 1_000_000
+
 
-def _split_by_years(X, y, years_train):
-    train_indices = X["yr"].isin(years_train)
-    test_indices = ~train_indices
-    X_train, y_train = X[train_indices], y[train_indices]
-    X_test, y_test = X[test_indices], y[test_indices]
-    return X_train, X_test, y_train, y_test
+def _split_by_years(df, columns, target_column, years_train, splits):
+    """
+    Select the feature columns and target of the requested splits only. Rows are
+    taken as a slice when a split is contiguous, as it is for a single time-sorted
+    series, instead of through a boolean mask. These are still copies, not views:
+    `df.iloc[rows, column_indices]` always copies the selected columns, and the
+    target is copied so as not to keep the whole processed frame alive. What is
+    saved is the matrices of the splits not requested, not the peak memory, which
+    is reached while processing the frame.
+    """
+    is_train = df["yr"].isin(years_train).to_numpy()
+    masks = {"train": is_train, "test": ~is_train}
+    column_indices = df.columns.get_indexer(columns)
+    target_index = df.columns.get_loc(target_column)
+    split_mapping = {}
+    for split in splits:
+        rows = _mask_to_rows(masks[split])
+        split_mapping[split] = (
+            df.iloc[rows, column_indices],
+            df.iloc[rows, target_index].copy(),
+        )
+    return split_mapping
+
+
+def _mask_to_rows(mask: np.ndarray) -> t.Union[slice, np.ndarray]:
+    (indices,) = np.nonzero(mask)
+    if len(indices) == 0:
+        return slice(0, 0)
+    if indices[-1] - indices[0] + 1 == len(indices):
+        return slice(indices[0], indices[-1] + 1)
+    return indices
 
 
 def get_dataset(
-    reader: DatasetReader, splits: t.Iterable[SplitName], years_train: t.List
+    reader: DatasetReader,
+    splits: t.Iterable[SplitName],
+    years_train: t.List,
+    key_column: t.Optional[str] = None,
+    n_jobs: int = 1,
 ):
+    """
+    Build the train/test matrices. When `key_column` is given, the input holds one
+    hourly series per key (e.g. per station) and the resulting matrices stack all
+    of them.
+    """
     df = reader()
-    df = clean_dataset(df)
     (
         df,
         shifted_varnames_cnt,
         shifted_varnames_num,
         shifted_varnames_cat,
-    ) = expand_dataset(df)
-    feature_columns = (
-        [
+    ) = _process_dataset(df, key_column=key_column, n_jobs=n_jobs)
+    feature_columns = _get_feature_columns(
+        shifted_varnames_cnt, shifted_varnames_num, shifted_varnames_cat, key_column
+    )
+    split_mapping = _split_by_years(df, feature_columns, "cnt", years_train, splits)
+    return (
+        split_mapping,
+        shifted_varnames_cnt,
+        shifted_varnames_num,
+        shifted_varnames_cat,
+    )
+
+
+def get_incremental_dataset(
+    reader: DatasetReader,
+    since: pd.Timestamp,
+    history_hours: int = LAG_HISTORY_HOURS,
+    key_column: t.Optional[str] = None,
+    n_jobs: int = 1,
+):
+    """
+    Build the training matrix only for the rows recorded after `since`.
+
+    A tail of `history_hours` hours before `since` (plus one day used to fill
+    gaps from similar rows) is processed alongside the new rows so that the
+    lagged features of the first new hours are computed correctly, and is then
+    dropped.
+    """
+    df = reader()
+    start = since - datetime.timedelta(hours=history_hours) - datetime.timedelta(days=1)
+    df = df[_get_timestamps(df) > start]
+    (
+        df,
+        shifted_varnames_cnt,
+        shifted_varnames_num,
+        shifted_varnames_cat,
+    ) = _process_dataset(df, key_column=key_column, n_jobs=n_jobs)
+    df = df[df.index > since]
+    feature_columns = _get_feature_columns(
+        shifted_varnames_cnt, shifted_varnames_num, shifted_varnames_cat, key_column
+    )
+    target_column = "cnt"
+    return (
+        (df[feature_columns], df[target_column]),
+        shifted_varnames_cnt,
+        shifted_varnames_num,
+        shifted_varnames_cat,
+    )
+
+
+def iter_dataset_chunks(
+    chunks: t.Iterable[pd.DataFrame],
+    key_column: t.Optional[str] = None,
+    history_hours: int = LAG_HISTORY_HOURS,
+) -> t.Iterator[t.Tuple[pd.DataFrame, pd.Series]]:
+    """
+    Clean and expand a time-sorted raw dataset read in chunks, yielding the same
+    features `get_dataset` would build (with all years), one block per chunk.
+
+    Each chunk is processed together with a tail of the raw rows before it (as in
+    `get_incremental_dataset`), so memory depends on the chunk size only. Rows of
+    the last hour of a chunk are held back until the next one, so that an hour
+    split across chunks (one row per key) is processed as a whole.
+    """
+    context = None
+    pending = None
+    last_emitted = None
+    margin = datetime.timedelta(hours=history_hours)
+
+    def process(raw):
+        df, cnt, num, cat = _process_dataset(raw, key_column=key_column)
+        if last_emitted is not None:
+            df = df[_is_after(df, last_emitted, key_column)]
+        feature_columns = _get_feature_columns(cnt, num, cat, key_column)
+        return df[feature_columns], df["cnt"]
+
+    for chunk in chunks:
+        raw = chunk if pending is None else pd.concat([pending, chunk])
+        timestamps = _get_timestamps(raw)
+        last_hour = timestamps == timestamps.max()
+        pending = raw[last_hour]
+        ready = raw[~last_hour]
+        if len(ready) == 0:
+            continue
+        if context is not None:
+            ready = pd.concat([context, ready])
+        X, y = process(ready)
+        if len(X) > 0:
+            yield X, y
+            last_emitted = _get_last_emitted(X, last_emitted, key_column)
+        context = _get_context(ready, margin, key_column)
+
+    if pending is not None and len(pending) > 0:
+        raw = pending if context is None else pd.concat([context, pending])
+        X, y = process(raw)
+        if len(X) > 0:
+            yield X, y
+
+
+def _is_after(df, last_emitted, key_column=None):
+    if key_column is None:
+        return df.index > last_emitted
+    # Keys not emitted yet map to NaT, which never compares as less or equal
+    last = df[key_column].map(last_emitted).to_numpy(dtype="datetime64[ns]")
+    return ~(df.index.to_numpy() <= last)
+
+
+def _get_last_emitted(X, previous=None, key_column=None):
+    """Last emitted hour, per key for keyed datasets as their gaps differ."""
+    if key_column is None:
+        return X.index.max()
+    latest = pd.Series(X.index, index=X[key_column]).groupby(level=0).max()
+    if previous is None:
+        return latest
+    return pd.concat([previous, latest]).groupby(level=0).max()
+
+
+def _get_context(raw, margin, key_column=None):
+    """
+    Raw rows needed to compute the features of the hours following `raw`: those
+    within `margin` of its last hour, extended back until the first day they
+    cover is complete, so that missing hours (even whole missing days) are filled
+    from the same rows as when processing the full dataset.
+    """
+    timestamps = _get_timestamps(raw)
+    day = datetime.timedelta(days=1)
+    start = timestamps.max() - margin - day
+    while start > timestamps.min():
+        first_day = (timestamps > start) & (timestamps <= start + day)
+        if key_column is None:
+            complete = timestamps[first_day].nunique() == 24
+        else:
+            hours = timestamps[first_day].groupby(raw[key_column][first_day]).nunique()
+            complete = len(hours) > 0 and hours.min() == 24
+        if complete:
+            break
+        start -= day
+    return raw[timestamps > start]
+
+
+def _process_dataset(df, key_column=None, n_jobs=1):
+    """
+    Clean and expand the raw dataset. Keyed inputs large enough are split into
+    partitions holding whole series, which are processed in parallel and stacked.
+    """
+    if key_column is None or n_jobs <= 1 or len(df) < PARALLEL_MIN_ROWS:
+        return _clean_and_expand(df, key_column)
+
+    partition = pd.factorize(df[key_column])[0] % n_jobs
+    partitions = [df[partition == i] for i in range(n_jobs) if (partition == i).any()]
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        results = list(pool.map(_clean_and_expand, partitions, repeat(key_column)))
+
+    df = pd.concat([result[0] for result in results])
+    df = df.sort_values(key_column, kind="stable")
+    return (df,) + results[0][1:]
+
+
+def _clean_and_expand(df, key_column=None):
+    df = clean_dataset(df, key_column=key_column)
+    return expand_dataset(df, key_column=key_column)
+
+
+def _get_feature_columns(
+    shifted_varnames_cnt, shifted_varnames_num, shifted_varnames_cat, key_column=None
+):
+    return (
+        ([key_column] if key_column is not None else [])
+        + [
             "season",
             "yr",
             "mnth",
@@ -51,19 +261,6 @@ def get_dataset(
         + shifted_varnames_cat
         + shifted_varnames_num
     )
-    target_column = "cnt"
-    y = df[target_column]
-    X = df[feature_columns]
-
-    X_train, X_test, y_train, y_test = _split_by_years(X, y, years_train)
-
-    split_mapping = {"train": (X_train, y_train), "test": (X_test, y_test)}
-    return (
-        {k: split_mapping[k] for k in splits},
-        shifted_varnames_cnt,
-        shifted_varnames_num,
-        shifted_varnames_cat,
-    )
 
 
 def _chain(functions: t.List[t.Callable[[pd.DataFrame], pd.DataFrame]]):
@@ -75,24 +272,54 @@ def _chain(functions: t.List[t.Callable[[pd.DataFrame], pd.DataFrame]]):
     return helper
 
 
-def clean_dataset(df: pd.DataFrame) -> pd.DataFrame:
+def clean_dataset(df: pd.DataFrame, key_column: t.Optional[str] = None) -> pd.DataFrame:
     cleaning_fn = _chain(
-        [_add_dateindex, _drop_columns_stage_1, _fix_date_columns, _fix_other_columns]
+        [
+            functools.partial(_add_dateindex, key_column=key_column),
+            _drop_columns_stage_1,
+            _fix_date_columns,
+            functools.partial(_fix_other_columns, key_column=key_column),
+        ]
     )
     df = cleaning_fn(df)
     return df
 
 
-def _add_dateindex(df):
+def _add_dateindex(df, key_column=None):
     """
     Generate a datetime index for the dataset, which will be used for some tasks
-    further down the pipeline
+    further down the pipeline. Keyed series are reindexed independently over
+    their own time range and kept sorted by key and time.
     """
-    df.index = pd.to_datetime(df["dteday"] + " " + df["hr"].astype("str") + ":00:00")
-    df = df.reindex(pd.date_range(start=min(df.index), end=max(df.index), freq="1H"))
+    timestamps = pd.DatetimeIndex(_get_timestamps(df))
+    if key_column is None:
+        df = df.set_axis(timestamps, axis=0)
+        return df.reindex(
+            pd.date_range(start=min(df.index), end=max(df.index), freq="1H")
+        )
+
+    hour = pd.Timedelta(hours=1)
+    bounds = timestamps.to_series(index=df.index).groupby(df[key_column]).agg(
+        ["min", "max"]
+    )
+    lengths = ((bounds["max"] - bounds["min"]) // hour + 1).to_numpy()
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    full_index = pd.MultiIndex.from_arrays(
+        [
+            np.repeat(bounds.index.to_numpy(), lengths),
+            np.repeat(bounds["min"].to_numpy(), lengths) + offsets * hour,
+        ],
+        names=[key_column, None],
+    )
+    df = df.set_index([df[key_column], timestamps]).drop(columns=key_column)
+    df = df.reindex(full_index).reset_index(level=key_column)
     return df
 
 
+def _get_timestamps(df):
+    return pd.to_datetime(df["dteday"] + " " + df["hr"].astype("str") + ":00:00")
+
+
 def _drop_columns_stage_1(df):
     """
     Drop columns not required after generating the datetime index.
@@ -115,9 +342,12 @@ def _fix_date_columns(df):
     return df
 
 
-def _fix_other_columns(df):
+def _fix_other_columns(df, key_column=None):
     """
-    Fills all other columns using reasonably similar rows.
+    Fills all other columns using reasonably similar rows: the previous hour (or
+    the next one at midnight) when it is complete, otherwise the same hour of the
+    previous day. Season and holiday are taken from the first complete row of the
+    same day. Rows are only ever filled from their own series.
     """
     cols_to_fill1 = [
         "season",
@@ -129,52 +359,80 @@ def _fix_other_columns(df):
         "windspeed",
         "cnt",
     ]
-    dhour = datetime.timedelta(hours=1)
-    dday = datetime.timedelta(days=1)
-    null_idxs = df[df.isna().any(axis=1)].index
+    keys = df[key_column].to_numpy() if key_column is not None else None
+    gaps = df.isna().any(axis=1).to_numpy()
+    if not gaps.any():
+        return df
 
-    for idx in null_idxs:
-        if (idx - dhour).dayofweek == idx.dayofweek:
-            similar_row = df.loc[idx - dhour]
-        else:
-            similar_row = df.loc[idx + dhour]
-        if similar_row.isna().any():
-            similar_row = df.loc[idx - dday]
-        df.loc[idx, cols_to_fill1] = similar_row[cols_to_fill1]
+    same_day = (df.index.hour != 0)[:, None]
+    values = df[cols_to_fill1]
+    neighbours = np.where(
+        same_day,
+        _shift(values, 1, keys).to_numpy(),
+        _shift(values, -1, keys).to_numpy(),
+    )
+    neighbour_is_gap = np.where(
+        same_day[:, 0],
+        _shift(pd.Series(gaps), 1, keys, fill_value=True).to_numpy(bool),
+        _shift(pd.Series(gaps), -1, keys, fill_value=True).to_numpy(bool),
+    )
+
+    filled = values.to_numpy(dtype=float, copy=True)
+    from_neighbour = gaps & ~neighbour_is_gap
+    filled[from_neighbour] = neighbours[from_neighbour]
+
+    # Whole days missing are filled from the previous day, one day per pass
+    pending = gaps & neighbour_is_gap
+    while pending.any():
+        previous_day = _shift(pd.DataFrame(filled), 24, keys).to_numpy()
+        available = pending & ~np.isnan(previous_day).any(axis=1)
+        if not available.any():
+            break
+        filled[available] = previous_day[available]
+        pending &= ~available
+    df[cols_to_fill1] = filled
 
     cols_to_fill2 = ["season", "holiday"]
+    days = [df.index.normalize()]
+    if keys is not None:
+        days = [keys] + days
+    same_day_values = (
+        df[cols_to_fill2]
+        .where(np.broadcast_to(~gaps[:, None], (len(df), len(cols_to_fill2))))
+        .groupby(days)
+        .transform("first")
+        .to_numpy()
+    )
+    df.loc[gaps, cols_to_fill2] = same_day_values[gaps]
 
-    for idx in null_idxs:
+    return df
 
-        candidates = df[
-            (~df.isna().any(axis=1))
-            & (df.index.day == idx.day)
-            & (df.index.month == idx.month)
-            & (df.index.year == idx.year)
-        ]
-        similar_row = candidates.iloc[0, :]
-        df.loc[idx, cols_to_fill2] = similar_row[cols_to_fill2]
 
-    return df
+def _shift(values, periods, keys=None, **kwargs):
+    if keys is None:
+        return values.shift(periods, **kwargs)
+    return values.groupby(keys).shift(periods, **kwargs)
 
 
-def expand_dataset(df: pd.DataFrame) -> t.Tuple[pd.DataFrame, t.List, t.List, t.List]:
+def expand_dataset(
+    df: pd.DataFrame, key_column: t.Optional[str] = None
+) -> t.Tuple[pd.DataFrame, t.List, t.List, t.List]:
 
+    keys = df[key_column].to_numpy() if key_column is not None else None
     (
         df,
         shifted_varnames_cnt,
         shifted_varnames_num,
         shifted_varnames_cat,
-    ) = _get_shifted_timeseries(df)
-    df, shifted_varnames_cnt = _get_diffd_timeseries(df, shifted_varnames_cnt)
+    ) = _get_shifted_timeseries(df, keys)
+    df, shifted_varnames_cnt = _get_diffd_timeseries(df, shifted_varnames_cnt, keys)
     df = _fix_ts_nulls(df)
     return df, shifted_varnames_cnt, shifted_varnames_num, shifted_varnames_cat
 
 
-def _get_shifted_timeseries(df):
-    def get_rolled_variables(df, shifts, variables_to_shift):
+def _get_shifted_timeseries(df, keys=None):
+    def get_rolled_variables(df_rolld, shifts, variables_to_shift):
         shifted_varnames = []
-        df_rolld = df.copy()
         for var in variables_to_shift:
             for shift in shifts:
                 col_name = (
@@ -183,11 +441,12 @@ def _get_shifted_timeseries(df):
                     else var + "_" + str(shift // 24) + "_days"
                 )
                 shifted_varnames.append(col_name)
-                df_rolld[col_name] = df_rolld[var].shift(shift)
+                df_rolld[col_name] = _shift(df_rolld[var], shift, keys)
         return df_rolld, shifted_varnames
 
+    # Copied once, the lagged columns are then added in place
     df_rolld, shifted_varnames_cnt = get_rolled_variables(
-        df, shifts=[1, 2, 3, 24 * 7], variables_to_shift=["cnt"]
+        df.copy(), shifts=[1, 2, 3, 24 * 7], variables_to_shift=["cnt"]
     )
 
     df_rolld, shifted_varnames_num = get_rolled_variables(
@@ -203,10 +462,12 @@ def _get_shifted_timeseries(df):
     return df_rolld, shifted_varnames_cnt, shifted_varnames_num, shifted_varnames_cat
 
 
-def _get_diffd_timeseries(df, shifted_varnames_cnt):
+def _get_diffd_timeseries(df, shifted_varnames_cnt, keys=None):
     if "cnt_1_hours" in df.columns:
-        df["cnt_last_hour_diff"] = df["cnt_1_hours"].diff()
-        df[["cnt_1_hours", "cnt_2_hours", "cnt", "cnt_last_hour_diff"]].head()
+        if keys is None:
+            df["cnt_last_hour_diff"] = df["cnt_1_hours"].diff()
+        else:
+            df["cnt_last_hour_diff"] = df["cnt_1_hours"].groupby(keys).diff()
         shifted_varnames_cnt = shifted_varnames_cnt + ["cnt_last_hour_diff"]
 
     return df, shifted_varnames_cnt
@@ -218,10 +479,15 @@ def _fix_ts_nulls(df):
 
 
 def aggregate_features(
-    shifted_varnames_cnt, shifted_varnames_num, shifted_varnames_cat
+    shifted_varnames_cnt,
+    shifted_varnames_num,
+    shifted_varnames_cat,
+    key_column: t.Optional[str] = None,
 ):
+    key_features = [key_column] if key_column is not None else []
     model_features = (
-        [
+        key_features
+        + [
             "season",
             "mnth",
             "hr",
@@ -239,15 +505,19 @@ def aggregate_features(
         + shifted_varnames_num
     )
 
-    categorical_features = [
-        "season",
-        "mnth",
-        "hr",
-        "holiday",
-        "weekday",
-        "workingday",
-        "weathersit",
-    ] + shifted_varnames_cat
+    categorical_features = (
+        key_features
+        + [
+            "season",
+            "mnth",
+            "hr",
+            "holiday",
+            "weekday",
+            "workingday",
+            "weathersit",
+        ]
+        + shifted_varnames_cat
+    )
 
     numerical_features = (
         ["temp", "atemp", "hum", "windspeed"]
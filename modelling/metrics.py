@@ -14,6 +14,19 @@ def bike_demand_error(y_true, y_pred, understock_price=0.5, overstock_price=0.5)
     return np.mean((np.abs(error) * factor))
 
 
+def get_cost_optimal_quantile(name: str, **params) -> float:
+    """
+    Quantile of the demand minimizing the expected `name` cost: for linear
+    understock and overstock prices, understock / (understock + overstock).
+    """
+    mapping = {_bde(): _bde_cost_optimal_quantile}
+    return mapping[name](**params)
+
+
+def _bde_cost_optimal_quantile(understock_price=0.5, overstock_price=0.5):
+    return understock_price / (understock_price + overstock_price)
+
+
 def get_metric_name_mapping():
     return {_bde(): bike_demand_error}
 
@@ -1,18 +1,28 @@
+import threading
 import typing as t
 
+import numpy as np
+
 from sklearn.base import BaseEstimator
+from sklearn.base import clone
 from sklearn.base import TransformerMixin
 from sklearn.compose import ColumnTransformer
-from sklearn.ensemble import RandomForestRegressor
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import OneHotEncoder
-import xgboost as xgb
+
 
 class BikeRentalFeatureSelection(BaseEstimator, TransformerMixin):
+    """Selects the model features, recording the dtype and observed range of each
+    of them so that serving can check its inputs against the training data.
+    """
+
     def __init__(self, feature_columns):
         self.feature_columns = feature_columns
 
     def fit(self, X, y=None):
+        self.feature_schema_ = [
+            _describe_column(name, X[name]) for name in self.feature_columns
+        ]
         return self
 
     def transform(self, X):
@@ -50,6 +60,158 @@ class BikeColumnTransformer(BaseEstimator, TransformerMixin):
         return X_
 
 
+def _describe_column(name, values) -> t.Dict[str, t.Any]:
+    description = {"name": name, "dtype": str(values.dtype)}
+    if values.dtype.kind in "biuf":
+        array = values.to_numpy(dtype=float)
+        description["integer"] = bool(np.all(array == np.floor(array)))
+        description["min"] = float(array.min())
+        description["max"] = float(array.max())
+    return description
+
+
+def get_feature_schema(estimator: Pipeline) -> t.List[t.Dict[str, t.Any]]:
+    """
+    Features expected by a fitted pipeline, in order, with their dtype, observed
+    range and, for categorical features, the domain of values seen in training.
+    Models fitted before ranges were recorded only report order and domains.
+    """
+    selector = estimator.named_steps["selector"]
+    schema = getattr(selector, "feature_schema_", None)
+    if schema is None:
+        schema = [{"name": name} for name in selector.feature_columns]
+    schema = [dict(feature) for feature in schema]
+
+    column_transformer = estimator.named_steps.get("column_transformer")
+    if column_transformer is not None:
+        encoder = column_transformer._column_transformer.named_transformers_["onehot"]
+        domains = dict(zip(column_transformer.categorical_features, encoder.categories_))
+        for feature in schema:
+            if feature["name"] in domains:
+                feature["domain"] = domains[feature["name"]].tolist()
+    return schema
+
+
+def prune_estimator(estimator: Pipeline, rounds: int) -> Pipeline:
+    """Copy of a fitted pipeline whose booster keeps its first `rounds` rounds.
+
+    The later rounds make the smallest corrections, and prediction time grows with
+    the number of trees, so this trades a little accuracy for faster batches while
+    keeping XGBoost's own predictor.
+    """
+    *preprocessing, (name, regressor) = estimator.steps
+    booster = regressor.get_booster()[:rounds]
+    # Attributes of early stopping refer to the rounds of the whole booster
+    booster.set_attr(best_iteration=None, best_ntree_limit=None, best_score=None)
+    pruned = clone(regressor).set_params(n_estimators=booster.num_boosted_rounds())
+    pruned._Booster = booster
+    return Pipeline(preprocessing + [(name, pruned)])
+
+
+class PinballLoss:
+    """XGBoost objective: the pinball loss of `quantiles[j]` for output j.
+
+    Its hessian is zero, so a constant one is used and each boosting round moves
+    the predictions by at most the learning rate.
+    """
+
+    def __init__(self, quantiles: t.Sequence[float]):
+        self.quantiles = np.asarray(quantiles, dtype=float)
+
+    def __call__(self, y_true: np.ndarray, y_pred: np.ndarray):
+        residual = y_true.reshape(y_pred.shape) - y_pred
+        grad = np.where(residual > 0, -self.quantiles, 1 - self.quantiles)
+        return grad.reshape(-1), np.ones(y_pred.size)
+
+
+class QuantileRegressor(BaseEstimator):
+    """Predicts several quantiles of the demand with one multi-output XGBoost model.
+
+    The quantiles are fitted on log1p(y): quantiles are preserved by monotonic
+    transforms, and on that scale the bounded steps of the pinball loss reach
+    the targets in a usual number of rounds. Predicted quantiles are sorted per
+    row so that they never cross. `cost_optimal` is the quantile minimizing an
+    asymmetric cost (see `metrics.get_cost_optimal_quantile`), included in the
+    predicted ones.
+    """
+
+    def __init__(
+        self,
+        quantiles: t.Sequence[float] = (0.1, 0.9),
+        cost_optimal: t.Optional[float] = None,
+        params: t.Optional[t.Dict[str, t.Any]] = None,
+    ):
+        self.quantiles = quantiles
+        self.cost_optimal = cost_optimal
+        self.params = params
+
+    def fit(self, X, y):
+        import xgboost as xgb
+
+        levels = list(self.quantiles)
+        if self.cost_optimal is not None:
+            levels.append(self.cost_optimal)
+        self.quantiles_ = np.unique(np.asarray(levels, dtype=float))
+        self.cost_optimal_index_ = (
+            None
+            if self.cost_optimal is None
+            else int(np.searchsorted(self.quantiles_, self.cost_optimal))
+        )
+        z = np.log1p(np.asarray(y, dtype=float))
+        # Each round moves the predictions by at most the learning rate (see
+        # PinballLoss): many small rounds of shallow trees generalize to new data,
+        # where deep trees at the default rate fit the training quantiles only
+        params = {
+            "tree_method": "hist",
+            "n_estimators": 300,
+            "max_depth": 6,
+            "learning_rate": 0.1,
+            **(self.params or {}),
+        }
+        self.regressor_ = xgb.XGBRegressor(
+            **params,
+            objective=PinballLoss(self.quantiles_),
+            base_score=float(np.median(z)),
+        )
+        self.regressor_.fit(X, np.repeat(z[:, None], len(self.quantiles_), axis=1))
+        return self
+
+    def predict(self, X) -> np.ndarray:
+        """Quantiles of each row, one column per level of `quantiles_`."""
+        z = self.regressor_.predict(X).reshape(-1, len(self.quantiles_))
+        return np.expm1(np.sort(z, axis=1)).clip(min=0)
+
+    def predict_cost_optimal(self, X) -> np.ndarray:
+        return self.predict(X)[:, self.cost_optimal_index_]
+
+
+def fit_quantile_regressor(
+    estimator: Pipeline,
+    X,
+    y,
+    quantiles: t.Sequence[float],
+    cost_optimal: t.Optional[float] = None,
+    params: t.Optional[t.Dict[str, t.Any]] = None,
+) -> QuantileRegressor:
+    """Fit a `QuantileRegressor` on the features encoded by a fitted pipeline."""
+    *preprocessing, _ = estimator.steps
+    X_ = Pipeline(preprocessing).transform(X) if preprocessing else X
+    return QuantileRegressor(quantiles, cost_optimal, params).fit(X_, y)
+
+
+def predict_quantiles(
+    estimator: Pipeline, quantile_regressor: QuantileRegressor, X
+) -> t.Tuple[np.ndarray, np.ndarray]:
+    """Point predictions and quantiles, encoding the features once.
+
+    They come from different models, so a point prediction can fall outside the
+    predicted quantiles, mostly where the demand differs from the training data.
+    """
+    *preprocessing, (_, regressor) = estimator.steps
+    X_ = Pipeline(preprocessing).transform(X) if preprocessing else X
+    return regressor.predict(X_), quantile_regressor.predict(X_)
+
+
 def build_estimator(hyperparams: t.Dict[str, t.Any]):
     estimator_mapping = get_estimator_mapping()
     steps = []
@@ -60,7 +222,47 @@ def build_estimator(hyperparams: t.Dict[str, t.Any]):
     return model
 
 
+def continue_training(estimator: Pipeline, X, y, rounds: int) -> Pipeline:
+    """Add `rounds` boosting rounds to a fitted pipeline using new data only.
+
+    The preprocessing steps are kept as fitted, so the new rows are encoded exactly
+    as the ones the base booster was trained on.
+    """
+    *preprocessing, (name, regressor) = estimator.steps
+    X_ = Pipeline(preprocessing).transform(X) if preprocessing else X
+    updated = clone(regressor).set_params(n_estimators=rounds)
+    updated.fit(X_, y, xgb_model=regressor.get_booster())
+    return Pipeline(preprocessing + [(name, updated)])
+
+
+class ChunkPredictor:
+    """Predicts chunks of rows with a fitted pipeline.
+
+    Each chunk is encoded and copied into a float32 buffer (the precision XGBoost
+    works with) that is reused across the chunks handled by the same thread, so
+    chunks can be predicted concurrently from a thread pool.
+    """
+
+    def __init__(self, estimator: Pipeline):
+        *preprocessing, (_, regressor) = estimator.steps
+        self._preprocessing = Pipeline(preprocessing) if preprocessing else None
+        self._regressor = regressor
+        self._local = threading.local()
+
+    def __call__(self, X):
+        X_ = self._preprocessing.transform(X) if self._preprocessing else X
+        X_ = np.asarray(X_)
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or buffer.shape[0] < X_.shape[0] or buffer.shape[1] != X_.shape[1]:
+            buffer = self._local.buffer = np.empty(X_.shape, dtype=np.float32)
+        view = buffer[: X_.shape[0]]
+        np.copyto(view, X_, casting="same_kind")
+        return self._regressor.predict(view)
+
+
 def get_estimator_mapping():
+    import xgboost as xgb
+
     return {
         "selector": BikeRentalFeatureSelection,
         "column_transformer": BikeColumnTransformer,
@@ -0,0 +1,330 @@
+import io
+import json
+import os
+import typing as t
+
+import numpy as np
+import pandas as pd
+
+from data import _get_timestamps
+
+# A key joins a logged prediction with its observed count: the hour predicted and,
+# for keyed models, the series (e.g. station), as a string
+_KEY_SEPARATOR = "|"
+_HOUR_FORMAT = "%Y-%m-%dT%H:00:00"
+# Features set by the calendar: recent traffic only covers a few of their values,
+# so their distribution always differs from that of the training years
+CALENDAR_FEATURES = (
+    "season",
+    "yr",
+    "mnth",
+    "hr",
+    "weekday",
+    "holiday",
+    "workingday",
+    "holiday_7_days",
+    "workingday_7_days",
+)
+# Training rows of the same value are the reference of the traffic of a season
+SEASON_COLUMN = "mnth"
+
+
+def read_new_lines(
+    path: str, offset: int, max_bytes: int = 16 * 2**20
+) -> t.Tuple[t.List[bytes], int]:
+    """
+    Complete lines appended to `path` after byte `offset`, at most about
+    `max_bytes` of them, and the offset to resume from. A file smaller than the
+    offset has been rotated and is read from the start.
+    """
+    if not os.path.exists(path):
+        return [], offset
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size < offset:
+            offset = 0
+        file.seek(offset)
+        content = file.read(max_bytes)
+        if len(content) == max_bytes:
+            content += file.readline()
+    end = content.rfind(b"\n") + 1
+    return content[:end].splitlines(), offset + end
+
+
+class Monitor:
+    """
+    Rolling statistics of a served model, updated from its prediction log and the
+    observed counts as they are appended, in memory independent of how long it
+    runs.
+
+    Feature distributions are histograms over bins fixed from the training data
+    (quantiles, plus one bin on each side for values outside the training range),
+    and errors a running mean. Both decay exponentially with `half_life`, counted
+    in rows, so that old traffic fades out. Predictions are kept until their
+    count is observed, or for `max_pending_hours` at most.
+
+    Weather and demand follow the seasons, so recent traffic is compared with the
+    training rows of the same months, weighted as the months of the traffic are.
+    Calendar features are left out, as they follow the date and not the traffic.
+    """
+
+    def __init__(self, state: t.Dict[str, t.Any]):
+        self.state = state
+
+    @classmethod
+    def create(
+        cls,
+        X_reference: pd.DataFrame,
+        reference_error: float,
+        bins: int = 10,
+        half_life: float = 1000,
+        max_pending_hours: int = 24 * 14,
+        exclude: t.Iterable[str] = CALENDAR_FEATURES,
+    ) -> "Monitor":
+        features = {}
+        columns = X_reference.select_dtypes("number").columns.difference(
+            exclude, sort=False
+        )
+        seasons = _season_keys(X_reference)
+        for name in columns:
+            values = X_reference[name].to_numpy(dtype=float)
+            edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)))
+            features[name] = {
+                "edges": edges.tolist(),
+                "reference": _histogram(values, edges).tolist(),
+                "seasonal": {
+                    season: _histogram(values[seasons == season], edges).tolist()
+                    for season in np.unique(seasons)
+                    if season
+                },
+                "current": [0.0] * (len(edges) + 1),
+            }
+        return cls(
+            {
+                "reference_error": reference_error,
+                "half_life": half_life,
+                "max_pending_hours": max_pending_hours,
+                "features": features,
+                "season_weights": {},
+                "error_sum": 0.0,
+                "error_weight": 0.0,
+                "joined": 0,
+                "logged": 0,
+                "pending": {},
+                "log_offset": 0,
+                "truth_offset": 0,
+                "truth_columns": None,
+            }
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "Monitor":
+        with open(path) as file:
+            return cls(json.load(file))
+
+    def save(self, path: str):
+        with open(path + ".tmp", "w") as file:
+            json.dump(self.state, file)
+        os.replace(path + ".tmp", path)
+
+    def _decay(self, n: int) -> float:
+        return 0.5 ** (n / self.state["half_life"])
+
+    def update(
+        self,
+        log_path: str,
+        truth_path: str,
+        key_column: t.Optional[str],
+        error_fn: t.Callable[[np.ndarray, np.ndarray], float],
+    ):
+        """Read what was appended to the prediction log and the dataset CSV."""
+        state = self.state
+        while True:
+            lines, state["log_offset"] = read_new_lines(log_path, state["log_offset"])
+            if not lines:
+                break
+            self.observe_predictions(lines, key_column)
+        while True:
+            lines, offset = read_new_lines(truth_path, state["truth_offset"])
+            if not lines:
+                break
+            if state["truth_offset"] == 0 or offset < state["truth_offset"]:
+                # Read from the start: the first line is the header
+                state["truth_columns"] = None
+            state["truth_offset"] = offset
+            self.observe_truth(lines, key_column, error_fn)
+
+    def observe_predictions(self, lines: t.List[bytes], key_column: t.Optional[str]):
+        """Update the feature statistics from lines of the prediction log."""
+        if not lines:
+            return
+        records = [json.loads(line) for line in lines]
+        inputs = pd.DataFrame.from_records([record["input"] for record in records])
+        decay = self._decay(len(records))
+        for name, feature in self.state["features"].items():
+            if name not in inputs:
+                continue
+            values = pd.to_numeric(inputs[name], errors="coerce").to_numpy()
+            counts = _histogram(values[~np.isnan(values)], feature["edges"])
+            feature["current"] = (
+                np.array(feature["current"]) * decay + counts
+            ).tolist()
+        seasons = _season_keys(inputs)
+        weights = self.state["season_weights"]
+        for season in weights:
+            weights[season] *= decay
+        for season, count in zip(*np.unique(seasons, return_counts=True)):
+            weights[season] = weights.get(season, 0.0) + float(count)
+        self.state["logged"] += len(records)
+
+        if "timestamp" in inputs:
+            timestamps = pd.to_datetime(inputs["timestamp"], errors="coerce")
+            keys = _join_keys(timestamps, inputs.get(key_column))
+            pending = self.state["pending"]
+            for key, record in zip(keys, records):
+                if key is not None:
+                    pending[key] = record["pred"]
+
+    def observe_truth(
+        self,
+        lines: t.List[bytes],
+        key_column: t.Optional[str],
+        error_fn: t.Callable[[np.ndarray, np.ndarray], float],
+    ):
+        """
+        Join lines appended to the dataset CSV with the pending predictions and
+        update the rolling error with `error_fn` (a mean over rows).
+        """
+        if self.state["truth_columns"] is None and lines:
+            self.state["truth_columns"] = lines[0].decode().strip().split(",")
+            lines = lines[1:]
+        if not lines:
+            return
+        truth = pd.read_csv(
+            io.BytesIO(b"\n".join(lines)),
+            names=self.state["truth_columns"],
+            header=None,
+        )
+        timestamps = _get_timestamps(truth)
+        keys = _join_keys(timestamps, truth.get(key_column))
+        pending = self.state["pending"]
+        matched = [i for i, key in enumerate(keys) if key in pending]
+        if matched:
+            y = truth["cnt"].to_numpy()[matched]
+            y_pred = np.array([pending.pop(keys[i]) for i in matched])
+            decay = self._decay(len(matched))
+            error = float(error_fn(y, y_pred))
+            self.state["error_sum"] = self.state["error_sum"] * decay + error * len(y)
+            self.state["error_weight"] = self.state["error_weight"] * decay + len(y)
+            self.state["joined"] += len(y)
+        self._expire(timestamps.max())
+
+    def _expire(self, now: pd.Timestamp):
+        oldest = now - pd.Timedelta(hours=self.state["max_pending_hours"])
+        # Keys start with the hour in a fixed-width format, so they sort by time
+        oldest_key = oldest.strftime(_HOUR_FORMAT)
+        self.state["pending"] = {
+            key: pred
+            for key, pred in self.state["pending"].items()
+            if key >= oldest_key
+        }
+
+    def drift(self) -> t.Dict[str, float]:
+        """
+        Population stability index of each feature against training, in the
+        months of the traffic.
+        """
+        return {
+            name: _population_stability_index(
+                self._reference(feature), np.array(feature["current"])
+            )
+            for name, feature in self.state["features"].items()
+            if sum(feature["current"]) > 0
+        }
+
+    def _reference(self, feature: t.Dict[str, t.Any]) -> np.ndarray:
+        # Rows of a month without training rows, or without a month, are compared
+        # with the whole training data
+        reference = np.zeros(len(feature["current"]))
+        for season, weight in self.state["season_weights"].items():
+            histogram = np.array(feature["seasonal"].get(season, feature["reference"]))
+            reference += weight * histogram / histogram.sum()
+        return reference if reference.sum() > 0 else np.array(feature["reference"])
+
+    def report(
+        self,
+        error_tolerance: float = 0.2,
+        drift_threshold: float = 0.2,
+        min_samples: int = 100,
+    ) -> t.Dict[str, t.Any]:
+        """
+        Current statistics and whether retraining is warranted: once enough
+        predictions have been observed, when the rolling error exceeds the
+        reference error by more than `error_tolerance` (a fraction) or a feature
+        drifts beyond `drift_threshold`. Drift is only judged once a half-life of
+        predictions was logged: before that, the histograms hold a few days of
+        traffic, whose weather can differ from that of their months.
+        """
+        state = self.state
+        error = (
+            state["error_sum"] / state["error_weight"]
+            if state["error_weight"]
+            else None
+        )
+        drift = self.drift()
+        reasons = []
+        if error is not None and state["joined"] >= min_samples:
+            if error > state["reference_error"] * (1 + error_tolerance):
+                reasons.append(
+                    f"error {error:.3f} above reference {state['reference_error']:.3f}"
+                )
+        if state["logged"] >= max(min_samples, state["half_life"]):
+            reasons.extend(
+                f"{name} drifted (PSI {value:.3f})"
+                for name, value in sorted(drift.items(), key=lambda item: -item[1])
+                if value > drift_threshold
+            )
+        return {
+            "retrain": bool(reasons),
+            "reasons": reasons,
+            "error": error,
+            "reference_error": state["reference_error"],
+            "logged": state["logged"],
+            "joined": state["joined"],
+            "pending": len(state["pending"]),
+            "drift": drift,
+        }
+
+
+def _histogram(values: np.ndarray, edges: t.Sequence[float]) -> np.ndarray:
+    # Bin 0 holds values below the first edge and the last one those from the last
+    return np.bincount(np.digitize(values, edges), minlength=len(edges) + 1).astype(
+        float
+    )
+
+
+def _season_keys(X: pd.DataFrame) -> np.ndarray:
+    # JSON keys of the state are strings, and "" stands for an unknown season
+    if SEASON_COLUMN not in X:
+        return np.full(len(X), "")
+    seasons = pd.to_numeric(X[SEASON_COLUMN], errors="coerce")
+    return np.where(seasons.isna(), "", seasons.fillna(0).astype(int).astype(str))
+
+
+def _population_stability_index(
+    reference: np.ndarray, current: np.ndarray, epsilon: float = 1e-4
+) -> float:
+    p = reference / reference.sum() + epsilon
+    q = current / current.sum() + epsilon
+    return float(np.sum((q - p) * np.log(q / p)))
+
+
+def _join_keys(
+    timestamps: pd.Series, series_keys: t.Optional[pd.Series]
+) -> t.List[t.Optional[str]]:
+    hours = timestamps.dt.strftime(_HOUR_FORMAT)
+    if series_keys is None:
+        return [hour if isinstance(hour, str) else None for hour in hours]
+    return [
+        f"{hour}{_KEY_SEPARATOR}{key}" if isinstance(hour, str) else None
+        for hour, key in zip(hours, series_keys.astype(str))
+    ]
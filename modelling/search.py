@@ -0,0 +1,114 @@
+import time
+import typing as t
+
+import numpy as np
+from joblib import Parallel
+from joblib import delayed
+from sklearn.base import BaseEstimator
+from sklearn.base import clone
+from sklearn.model_selection import KFold
+from sklearn.model_selection import ParameterGrid
+
+from catalog import params_key
+
+if t.TYPE_CHECKING:
+    from cluster import TaskServer
+
+
+def get_candidates(
+    param_grid: t.Dict[str, t.List[t.Any]],
+) -> t.List[t.Dict[str, t.Any]]:
+    return list(ParameterGrid(param_grid))
+
+
+def iter_fold_results(
+    estimator: BaseEstimator,
+    candidates: t.List[t.Dict[str, t.Any]],
+    X,
+    y,
+    scoring: t.Callable,
+    folds: int = 5,
+    n_jobs: t.Optional[int] = None,
+    completed: t.Iterable[t.Tuple[str, int]] = (),
+    server: t.Optional["TaskServer"] = None,
+) -> t.Iterator[t.Dict[str, t.Any]]:
+    """
+    Cross-validate the candidates as GridSearchCV does, yielding each fold's
+    result as soon as it finishes. Fits in `completed` ((params key, fold) pairs)
+    are skipped. They run on `n_jobs` local processes, or on the workers of
+    `server`, which receive the data once each.
+    """
+    completed = set(completed)
+    splits = list(KFold(folds).split(X, y))
+    tasks = [
+        (params, fold)
+        for params in candidates
+        for fold in range(folds)
+        if (params_key(params), fold) not in completed
+    ]
+    if not tasks:
+        return
+    shared = (estimator, X, y, splits, scoring)
+    if server is not None:
+        yield from server.run(_fit_and_score, shared, tasks)
+        return
+    results = Parallel(n_jobs=n_jobs, return_as="generator_unordered")(
+        delayed(_fit_and_score)(*shared, params, fold) for params, fold in tasks
+    )
+    yield from results
+
+
+def _fit_and_score(estimator, X, y, splits, scoring, params, fold):
+    train, test = splits[fold]
+    estimator = clone(estimator).set_params(**params)
+    start = time.perf_counter()
+    estimator.fit(X.iloc[train], y.iloc[train])
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    score = scoring(estimator, X.iloc[test], y.iloc[test])
+    score_time = time.perf_counter() - start
+    return {
+        "params": params,
+        "fold": fold,
+        "score": float(score),
+        "fit_time": fit_time,
+        "score_time": score_time,
+    }
+
+
+def summarize(
+    results: t.List[t.Dict[str, t.Any]], folds: int
+) -> t.List[t.Dict[str, t.Any]]:
+    """
+    Aggregate fold results per candidate, best first. Candidates are ranked by
+    mean score (higher is better, as for sklearn scorers) and marked `efficient`
+    when no cheaper candidate scores as well, which are the ones worth keeping
+    when the grid budget is cut.
+    """
+    by_candidate = {}
+    for result in results:
+        by_candidate.setdefault(params_key(result["params"]), []).append(result)
+
+    summary = []
+    for fold_results in by_candidate.values():
+        scores = np.array([result["score"] for result in fold_results])
+        fit_times = np.array([result["fit_time"] for result in fold_results])
+        summary.append(
+            {
+                "params": fold_results[0]["params"],
+                "folds": len(fold_results),
+                "complete": len(fold_results) == folds,
+                "mean_score": float(scores.mean()),
+                "std_score": float(scores.std()),
+                "mean_fit_time": float(fit_times.mean()),
+            }
+        )
+
+    best_so_far = -np.inf
+    for entry in sorted(summary, key=lambda entry: entry["mean_fit_time"]):
+        entry["efficient"] = entry["mean_score"] > best_so_far
+        best_so_far = max(best_so_far, entry["mean_score"])
+    summary.sort(key=lambda entry: (not entry["complete"], -entry["mean_score"]))
+    for rank, entry in enumerate(summary, start=1):
+        entry["rank"] = rank
+    return summary
@@ -1,25 +1,60 @@
+import asyncio
+import json
+import os
 import sys
 import typing as t
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from functools import lru_cache
 
 import joblib
 import numpy as np
 import pandas as pd
-from fastapi import Body  # type: ignore # noqa: E402
 from fastapi import Depends
 from fastapi import FastAPI
+from fastapi import HTTPException
+from fastapi import Request
+from fastapi.responses import JSONResponse
 from pydantic import BaseSettings
-from pydantic import PositiveFloat
 
+from entities import BatchValidationError
+from entities import check_model_input_parity
+from entities import compile_field_specs
+from entities import FIELD_SPECS
+from entities import FieldSpec
 from entities import ModelInput
+from entities import ModelOutput
+from entities import OPTIONAL_FIELDS
+from entities import validate_batch
 
 app = FastAPI(title="API for bike demand inference", version="0.0.1")
 
 
 class Settings(BaseSettings):
-    SERIALIZED_MODEL_PATH: str
     MODEL_LIB_DIR: str
+    # Either a serialized model or a model catalog to pick the best version from
+    SERIALIZED_MODEL_PATH: t.Optional[str] = None
+    MODEL_CATALOG_PATH: t.Optional[str] = None
+    MODEL_SELECTION_METRIC: str = "bike demand error"
+    MODEL_SELECTION_SPLIT: str = "test"
+    # Arrays in uncompressed joblib artifacts are memory-mapped and shared through
+    # the page cache, set to None to load them in memory instead
+    MODEL_MMAP_MODE: t.Optional[str] = "r"
+    # How far beyond the range observed in training (as a fraction of its span)
+    # numeric inputs are accepted, None disables range checks
+    FEATURE_RANGE_TOLERANCE: t.Optional[float] = 1.0
+    # Serve a variant saved next to the model (model.<variant>.joblib), e.g.
+    # "pruned" for faster batches
+    MODEL_VARIANT: t.Optional[str] = None
+    # Predictions run in a pool of threads off the event loop. Requests beyond
+    # those running and PREDICT_QUEUE_SIZE waiting are rejected with a 503.
+    PREDICT_THREADS: int = 1
+    PREDICT_QUEUE_SIZE: int = 16
+    # Threads used by XGBoost for each prediction, None keeps the model's setting
+    MODEL_NTHREAD: t.Optional[int] = None
+    # JSON lines log of the predictions, see the `monitor` command
+    PREDICTION_LOG_PATH: str = "log.log"
 
 
 @lru_cache(None)
@@ -29,11 +64,90 @@ def get_settings():
 
 @lru_cache(None)
 def load_estimator():
-    sys.path.append(get_settings().MODEL_LIB_DIR)
-    estimator = joblib.load(get_settings().SERIALIZED_MODEL_PATH)
+    path = get_variant_path(get_model_path())
+    estimator = joblib.load(path, mmap_mode=get_settings().MODEL_MMAP_MODE)
+    nthread = get_settings().MODEL_NTHREAD
+    regressor = estimator[-1] if hasattr(estimator, "steps") else estimator
+    if nthread is not None and hasattr(regressor, "get_xgb_params"):
+        regressor.set_params(n_jobs=nthread)
     return estimator
 
 
+class FeatureGuard(t.NamedTuple):
+    specs: t.List[FieldSpec]
+    optional_fields: t.List[str]
+    predictor: t.Any
+
+
+@lru_cache(None)
+def load_feature_guard() -> FeatureGuard:
+    """
+    Compile the request checks from the feature schema embedded in the model.
+    Validated inputs are built in the model's column order, so predictions skip
+    the selection of the features by name.
+    """
+    estimator = load_estimator()
+    if "selector" not in getattr(estimator, "named_steps", {}):
+        return FeatureGuard(FIELD_SPECS, OPTIONAL_FIELDS, estimator)
+
+    import model
+
+    schema = model.get_feature_schema(estimator)
+    for issue in check_model_input_parity(schema):
+        warnings.warn(issue)
+    specs = compile_field_specs(schema, get_settings().FEATURE_RANGE_TOLERANCE)
+    names = {spec.name for spec in specs}
+    optional_fields = [name for name in OPTIONAL_FIELDS if name not in names]
+    return FeatureGuard(specs, optional_fields, estimator[1:])
+
+
+@lru_cache(None)
+def get_model_path() -> str:
+    """
+    Path of the served model, resolved once so that the files saved with it are
+    read from the same version even if the catalog changes in between.
+    """
+    settings = get_settings()
+    # The model library reads the catalog and is needed to unpickle the models
+    sys.path.append(settings.MODEL_LIB_DIR)
+    if settings.SERIALIZED_MODEL_PATH is not None:
+        return settings.SERIALIZED_MODEL_PATH
+    if settings.MODEL_CATALOG_PATH is None:
+        raise ValueError("Set SERIALIZED_MODEL_PATH or MODEL_CATALOG_PATH")
+
+    import catalog
+
+    record = catalog.get_best_version(
+        settings.MODEL_CATALOG_PATH,
+        settings.MODEL_SELECTION_METRIC,
+        split=settings.MODEL_SELECTION_SPLIT,
+    )
+    if record is None:
+        raise ValueError(
+            f"No model in {settings.MODEL_CATALOG_PATH} has been evaluated on "
+            f"{settings.MODEL_SELECTION_METRIC} ({settings.MODEL_SELECTION_SPLIT})"
+        )
+    return os.path.join(
+        os.path.dirname(settings.MODEL_CATALOG_PATH), record["artifact"]
+    )
+
+
+@lru_cache(None)
+def load_quantile_regressor():
+    """Quantile model saved with the served model version, if any."""
+    path = os.path.join(os.path.dirname(get_model_path()), "quantiles.joblib")
+    if not os.path.exists(path):
+        return None
+    return joblib.load(path)
+
+
+def get_variant_path(model_path: str) -> str:
+    variant = get_settings().MODEL_VARIANT
+    if variant is None:
+        return model_path
+    return os.path.join(os.path.dirname(model_path), f"model.{variant}.joblib")
+
+
 # @app.post("/")
 # async def make_prediction(input_: str = Body(...), estimator=Depends(load_estimator)):
 #     """
@@ -74,32 +188,157 @@ def load_estimator():
 
 
 class Logger:
+    """
+    Appends one JSON line per prediction with the time it was made, the inputs
+    and the prediction, for `monitor` to read.
+    """
+
     def __init__(self, filepath="log.log"):
         self.filepath = filepath
 
-    def log(self, inputs: t.List[ModelInput], predictions):
-        file = open(self.filepath, "a")
-        for row, pred in zip(inputs, predictions):
-            record = {"datetime": datetime.now(), "input": row.dict(), "pred": pred}
-            print(record, file=file)
-        file.close()
+    def log(self, inputs: pd.DataFrame, predictions):
+        now = datetime.now().isoformat()
+        records = inputs.to_json(orient="records", lines=True).splitlines()
+        lines = [
+            f'{{"datetime": "{now}", "input": {record}, "pred": {pred}}}\n'
+            for record, pred in zip(records, predictions)
+        ]
+        # A single append per batch keeps the lines of concurrent workers whole
+        with open(self.filepath, "a") as file:
+            file.write("".join(lines))
 
 
 def get_logger():
-    return Logger()
+    return Logger(get_settings().PREDICTION_LOG_PATH)
+
+
+class PredictionPool:
+    """
+    Threads running the CPU-bound part of the requests, so that the event loop
+    (and the health check) stays responsive. Requests are admitted while at most
+    `queue_size` of them wait for a thread, and rejected with a 503 beyond that.
+    """
+
+    def __init__(self, threads: int, queue_size: int):
+        self.limit = threads + queue_size
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="predict")
+
+    async def run(self, fn: t.Callable, *args):
+        # Only the event loop thread updates `pending`, so no lock is needed
+        if self.pending >= self.limit:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many predictions in progress",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+
+@lru_cache(None)
+def get_prediction_pool() -> PredictionPool:
+    # Created on first use, i.e. in each worker after gunicorn forks
+    settings = get_settings()
+    return PredictionPool(settings.PREDICT_THREADS, settings.PREDICT_QUEUE_SIZE)
+
+
+def get_inputs(body: bytes, guard: FeatureGuard) -> pd.DataFrame:
+    """
+    Parse and validate the request body as a whole batch, which is much cheaper
+    than building one `ModelInput` per row.
+    """
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(
+            status_code=422,
+            detail=[
+                {"loc": ["body"], "msg": "invalid JSON", "type": "value_error.json"}
+            ],
+        )
+    try:
+        return validate_batch(payload, guard.specs, guard.optional_fields)
+    except BatchValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors)
+
 
+# `ModelInput` is only used to document the request body
+_PREDICT_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {
+                "schema": {"type": "array", "items": ModelInput.schema()}
+            }
+        },
+    }
+}
 
-@app.post("/predict", response_model=t.List[float])
+
+@app.post(
+    "/predict",
+    response_model=t.Union[t.List[float], t.List[ModelOutput]],
+    openapi_extra=_PREDICT_REQUEST_BODY,
+)
 async def make_prediction(
-    inputs: t.List[ModelInput] = Body(...),
-    estimator=Depends(load_estimator),
+    request: Request,
+    quantiles: bool = False,
+    guard: FeatureGuard = Depends(load_feature_guard),
+    quantile_regressor=Depends(load_quantile_regressor),
+    pool: PredictionPool = Depends(get_prediction_pool),
     logger=Depends(get_logger),
 ):
+    """
+    Predict the demand of each row. With `quantiles=true`, each prediction comes
+    with the quantiles of the demand predicted by the model, in the same call.
+    """
+    if quantiles and quantile_regressor is None:
+        raise HTTPException(
+            status_code=400, detail="The served model does not predict quantiles"
+        )
+    body = await request.body()
+    return await pool.run(
+        predict, body, guard, logger, quantile_regressor if quantiles else None
+    )
+
+
+def predict(
+    body: bytes,
+    guard: FeatureGuard,
+    logger: Logger,
+    quantile_regressor: t.Any = None,
+) -> JSONResponse:
+    X = get_inputs(body, guard)
+    if len(X) == 0:
+        return JSONResponse([])
+    if quantile_regressor is None:
+        prediction = guard.predictor.predict(X).astype(np.uint32).tolist()
+        logger.log(X, prediction)
+        # Rendered here rather than on the event loop
+        return JSONResponse(prediction)
+
+    import model
 
-    X = pd.DataFrame([row.dict() for row in inputs])
-    prediction = estimator.predict(X).astype(np.uint32).tolist()
-    logger.log(inputs, prediction)
-    return prediction
+    point, quantiles = model.predict_quantiles(guard.predictor, quantile_regressor, X)
+    prediction = point.astype(np.uint32).tolist()
+    logger.log(X, prediction)
+    levels = [f"{level:g}" for level in quantile_regressor.quantiles_]
+    optimal = quantile_regressor.cost_optimal_index_
+    return JSONResponse(
+        [
+            {
+                "prediction": value,
+                "quantiles": dict(zip(levels, row)),
+                "cost_optimal": row[optimal] if optimal is not None else None,
+            }
+            for value, row in zip(prediction, quantiles.astype(np.uint32).tolist())
+        ]
+    )
 
 
 @app.get("/get")
@@ -1,7 +1,8 @@
 import typing as t
-from msilib.schema import Binary
+from datetime import datetime
 
-import typing_extensions as te
+import numpy as np
+import pandas as pd
 from pydantic import BaseModel
 from pydantic import ConstrainedInt
 from pydantic import NonNegativeInt
@@ -17,11 +18,6 @@ class MonthInteger(ConstrainedInt):
     le = 12
 
 
-class YearInteger(ConstrainedInt):
-    ge = 1800
-    le = 2020
-
-
 class SeasonInteger(ConstrainedInt):
     ge = 1
     le = 4
@@ -43,12 +39,20 @@ class BinaryInteger(ConstrainedInt):
 
 
 class WeekdayInteger(ConstrainedInt):
-    ge = 1
-    le = 7
+    # Monday is 0, as computed by pandas when building the training data
+    ge = 0
+    le = 6
 
 
 # Nota: necesario buscar una forma de hacer esto de forma automática según como se entrenó el modelo!
+# The model documents the request schema (OpenAPI); requests are validated in
+# batch by `validate_batch`, against the feature schema embedded in the trained
+# model when available and otherwise against these bounds.
 class ModelInput(BaseModel):
+    # Series key (e.g. station) for models trained with `data.key_column: station`
+    station: t.Optional[t.Union[int, str]] = None
+    # Hour being predicted, logged to match predictions with the observed counts
+    timestamp: t.Optional[datetime] = None
     season: SeasonInteger
     yr: YearInteger
     mnth: MonthInteger
@@ -80,3 +84,226 @@ class ModelInput(BaseModel):
     windspeed_1_hours: float
     windspeed_2_hours: float
     windspeed_3_hours: float
+
+
+class ModelOutput(BaseModel):
+    """Prediction for a row when quantiles are requested."""
+
+    prediction: int
+    # Predicted quantiles of the demand by level, e.g. {"0.1": 12, "0.9": 40}
+    quantiles: t.Dict[str, int]
+    # Quantile minimizing the cost of understocking and overstocking
+    cost_optimal: t.Optional[int]
+
+
+class FieldSpec(t.NamedTuple):
+    name: str
+    integer: bool
+    ge: t.Optional[float]
+    le: t.Optional[float]
+    domain: t.Optional[np.ndarray] = None
+    numeric: bool = True
+
+
+def _get_field_specs() -> t.List[FieldSpec]:
+    specs = []
+    for field in ModelInput.__fields__.values():
+        if not field.required:
+            continue
+        type_ = field.type_
+        specs.append(
+            FieldSpec(
+                name=field.name,
+                integer=issubclass(type_, int),
+                ge=getattr(type_, "ge", None),
+                le=getattr(type_, "le", None),
+            )
+        )
+    return specs
+
+
+FIELD_SPECS = _get_field_specs()
+OPTIONAL_FIELDS = [
+    field.name for field in ModelInput.__fields__.values() if not field.required
+]
+
+
+def compile_field_specs(
+    schema: t.List[t.Dict[str, t.Any]], range_tolerance: t.Optional[float] = None
+) -> t.List[FieldSpec]:
+    """
+    Checks for the features of a trained model, in the model's column order, from
+    its feature schema (see `model.get_feature_schema`). Categorical features must
+    take a value seen in training; other numeric features must lie within their
+    observed range widened on each side by `range_tolerance` times its span
+    (None disables range checks).
+    """
+    specs = []
+    for feature in schema:
+        ge = le = None
+        if range_tolerance is not None and "min" in feature:
+            margin = range_tolerance * (feature["max"] - feature["min"])
+            ge, le = feature["min"] - margin, feature["max"] + margin
+        domain = feature.get("domain")
+        specs.append(
+            FieldSpec(
+                name=feature["name"],
+                integer=feature.get("integer", False),
+                ge=ge,
+                le=le,
+                domain=np.asarray(domain) if domain is not None else None,
+                numeric="dtype" not in feature or "min" in feature,
+            )
+        )
+    return specs
+
+
+def check_model_input_parity(schema: t.List[t.Dict[str, t.Any]]) -> t.List[str]:
+    """
+    Differences between the documented `ModelInput` and the features of a trained
+    model, e.g. a field whose bounds exclude values seen in training.
+    """
+    fields = ModelInput.__fields__
+    issues = []
+    for feature in schema:
+        field = fields.get(feature["name"])
+        if field is None:
+            issues.append(f"{feature['name']} is not a ModelInput field")
+            continue
+        if "domain" in feature and feature["domain"] and "min" not in feature:
+            low, high = min(feature["domain"]), max(feature["domain"])
+        elif "min" in feature:
+            low, high = feature["min"], feature["max"]
+        else:
+            continue
+        ge = getattr(field.type_, "ge", None)
+        le = getattr(field.type_, "le", None)
+        if (ge is not None and low < ge) or (le is not None and high > le):
+            issues.append(
+                f"{feature['name']} is documented in [{ge}, {le}] but was trained on "
+                f"[{low}, {high}]"
+            )
+    return issues
+
+
+class BatchValidationError(ValueError):
+    def __init__(self, errors: t.List[t.Dict[str, t.Any]]):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def validate_batch(
+    payload: t.Any,
+    specs: t.List[FieldSpec] = FIELD_SPECS,
+    optional_fields: t.List[str] = OPTIONAL_FIELDS,
+) -> pd.DataFrame:
+    """
+    Validate a list of records column by column and return them as a frame with
+    the columns of `specs`, in order, followed by `optional_fields`. Errors follow
+    pydantic's format, reporting the first offending row of each field.
+    """
+    if not isinstance(payload, list) or not all(isinstance(r, dict) for r in payload):
+        raise BatchValidationError(
+            [
+                {
+                    "loc": ["body"],
+                    "msg": "value is not a valid list",
+                    "type": "type_error.list",
+                }
+            ]
+        )
+
+    errors = []
+    columns = {}
+    for spec in specs:
+        values, error = _validate_column(spec, [row.get(spec.name) for row in payload])
+        if error is not None:
+            errors.append(error)
+        columns[spec.name] = values
+
+    if errors:
+        raise BatchValidationError(errors)
+
+    for name in optional_fields:
+        columns[name] = [row.get(name) for row in payload]
+    return pd.DataFrame(columns, index=pd.RangeIndex(len(payload)))
+
+
+def _validate_column(
+    spec: FieldSpec, raw: t.List[t.Any]
+) -> t.Tuple[np.ndarray, t.Optional[t.Dict[str, t.Any]]]:
+    if not spec.numeric:
+        return _validate_categorical_column(spec, raw)
+
+    kind = "integer" if spec.integer else "float"
+    try:
+        # Fast path: every value is a number (or a numeric string), None -> NaN
+        values = np.array(raw, dtype=float)
+        missing = np.isnan(values)
+        not_numeric = np.zeros_like(missing)
+    except (TypeError, ValueError):
+        values = pd.to_numeric(pd.Series(raw, dtype=object), errors="coerce").to_numpy(
+            dtype=float
+        )
+        missing = np.array([value is None for value in raw], dtype=bool)
+        not_numeric = np.isnan(values) & ~missing
+    checks = [
+        (missing, "field required", "value_error.missing"),
+        (not_numeric, f"value is not a valid {kind}", f"type_error.{kind}"),
+    ]
+    if spec.domain is not None:
+        checks.append(_domain_check(np.isin(values, spec.domain, invert=True), spec))
+    if spec.integer:
+        checks.append(
+            (
+                values != np.floor(values),
+                "value is not a valid integer",
+                "type_error.integer",
+            )
+        )
+    if spec.ge is not None:
+        checks.append(
+            (
+                values < spec.ge,
+                f"ensure this value is greater than or equal to {spec.ge}",
+                "value_error.number.not_ge",
+            )
+        )
+    if spec.le is not None:
+        checks.append(
+            (
+                values > spec.le,
+                f"ensure this value is less than or equal to {spec.le}",
+                "value_error.number.not_le",
+            )
+        )
+    for invalid, msg, type_ in checks:
+        if invalid.any():
+            return values, _error(int(np.argmax(invalid)), spec.name, msg, type_)
+    return (values.astype(np.int64) if spec.integer else values), None
+
+
+def _validate_categorical_column(
+    spec: FieldSpec, raw: t.List[t.Any]
+) -> t.Tuple[np.ndarray, t.Optional[t.Dict[str, t.Any]]]:
+    values = np.array(raw, dtype=object)
+    checks = [(values == None, "field required", "value_error.missing")]  # noqa: E711
+    if spec.domain is not None:
+        checks.append(
+            _domain_check(~pd.Series(values).isin(spec.domain).to_numpy(), spec)
+        )
+    for invalid, msg, type_ in checks:
+        if invalid.any():
+            return values, _error(int(np.argmax(invalid)), spec.name, msg, type_)
+    return values, None
+
+
+def _domain_check(invalid: np.ndarray, spec: FieldSpec):
+    permitted = ", ".join(map(str, spec.domain[:10]))
+    if len(spec.domain) > 10:
+        permitted += ", ..."
+    return invalid, f"unexpected value; permitted: {permitted}", "value_error.const"
+
+
+def _error(row: int, field: str, msg: str, type_: str) -> t.Dict[str, t.Any]:
+    return {"loc": ["body", row, field], "msg": msg, "type": type_}
@@ -0,0 +1,36 @@
+"""
+Gunicorn settings to serve the API with several workers sharing a single copy
+of the model:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The model is loaded once in the master process before the workers are forked,
+so its memory is shared copy-on-write instead of being loaded by every worker,
+and workers serve their first request warm.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# Split the cores between the prediction threads of all the workers, so that
+# concurrent predictions do not oversubscribe them
+predict_threads = workers * int(os.environ.get("PREDICT_THREADS", 1))
+nthread = max(1, multiprocessing.cpu_count() // predict_threads)
+os.environ.setdefault("MODEL_NTHREAD", str(nthread))
+
+
+def on_starting(server):
+    import app
+
+    # Only load the model: predicting here would start XGBoost's OpenMP threads,
+    # which do not survive fork.
+    app.load_feature_guard()
+    app.load_quantile_regressor()
+    # Keep the garbage collector from touching (and so copying) the pages of the
+    # objects loaded so far in every worker
+    gc.freeze()
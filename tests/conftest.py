@@ -0,0 +1,7 @@
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modelling modules import each other as top-level modules
+sys.path.insert(0, os.path.join(REPO_DIR, "modelling"))
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported inside the commands that need them, see the top of modelling/app.py
+HEAVY_DEPENDENCIES = ["pandas", "sklearn", "xgboost", "joblib", "yaml"]
+
+
+def _imported_modules(*args):
+    """Top-level names of the modules imported by running the CLI with `args`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "modelling/app.py", *args],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "imported package" not in line:
+            modules.add(line.rsplit("|", 1)[-1].strip().split(".")[0])
+    return modules
+
+
+def test_help_does_not_import_heavy_dependencies():
+    modules = _imported_modules("--help")
+    assert "typer" in modules
+    assert modules.isdisjoint(HEAVY_DEPENDENCIES), modules & set(HEAVY_DEPENDENCIES)
@@ -0,0 +1,54 @@
+import operator
+import threading
+from multiprocessing.connection import Client
+
+import cluster
+
+AUTHKEY = b"test"
+
+
+def _start_worker(address):
+    worker = threading.Thread(
+        target=cluster.run_worker, args=(address, AUTHKEY), daemon=True
+    )
+    worker.start()
+    return worker
+
+
+def test_run_returns_every_result():
+    with cluster.TaskServer(("127.0.0.1", 0), AUTHKEY) as server:
+        workers = [_start_worker(server.address) for _ in range(2)]
+        results = list(server.run(operator.add, (10,), [(i,) for i in range(6)]))
+    assert sorted(results) == [10 + i for i in range(6)]
+    for worker in workers:
+        worker.join(timeout=5)
+        assert not worker.is_alive()
+
+
+def test_task_of_a_lost_worker_is_run_by_another():
+    received = threading.Event()
+
+    def lost_worker(address):
+        # Takes a task, then disconnects without answering
+        with Client(address, authkey=AUTHKEY) as connection:
+            connection.recv()
+            connection.recv()
+            received.set()
+
+    with cluster.TaskServer(("127.0.0.1", 0), AUTHKEY) as server:
+        threading.Thread(target=lost_worker, args=(server.address,)).start()
+        results = server.run(operator.add, (10,), [(i,) for i in range(3)])
+        threading.Thread(
+            target=lambda: received.wait(5) and _start_worker(server.address)
+        ).start()
+        assert sorted(results) == [10, 11, 12]
+
+
+def test_workers_stop_when_closed_without_tasks():
+    server = cluster.TaskServer(("127.0.0.1", 0), AUTHKEY)
+    worker = _start_worker(server.address)
+    worker.join(timeout=1)
+    assert worker.is_alive()
+    server.close()
+    worker.join(timeout=5)
+    assert not worker.is_alive()
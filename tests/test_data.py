@@ -0,0 +1,284 @@
+import datetime
+import os
+import shutil
+import tracemalloc
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+import app
+import data
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET_PATH = os.path.join(REPO_DIR, "timeseries.csv")
+
+
+def _split_with_masks(df, columns, target_column, years_train):
+    """The splits as they were built before slicing, with boolean masks."""
+    X, y = df[columns], df[target_column]
+    is_train = X["yr"].isin(years_train)
+    return {"train": (X[is_train], y[is_train]), "test": (X[~is_train], y[~is_train])}
+
+
+@pytest.fixture(scope="module")
+def processed():
+    df, cnt, num, cat = data._process_dataset(pd.read_csv(DATASET_PATH))
+    return df, data._get_feature_columns(cnt, num, cat, None)
+
+
+@pytest.mark.parametrize("years_train", [[2011], [2012]])
+def test_split_by_years_matches_masks(processed, years_train):
+    df, columns = processed
+    expected = _split_with_masks(df, columns, "cnt", years_train)
+    split_mapping = data._split_by_years(
+        df, columns, "cnt", years_train, ["train", "test"]
+    )
+    for split, (X, y) in split_mapping.items():
+        pd.testing.assert_frame_equal(X, expected[split][0])
+        pd.testing.assert_series_equal(y, expected[split][1])
+
+
+def test_split_by_years_matches_masks_when_interleaved():
+    # Several series stacked: the years of a split are not contiguous rows
+    df = pd.DataFrame(
+        {
+            "yr": [2011, 2012, 2011, 2012, 2012, 2011],
+            "temp": np.linspace(0, 1, 6),
+            "cnt": np.arange(6),
+        },
+        index=pd.date_range("2011-01-01", periods=6, freq="H"),
+    )
+    expected = _split_with_masks(df, ["yr", "temp"], "cnt", [2011])
+    split_mapping = data._split_by_years(
+        df, ["yr", "temp"], "cnt", [2011], ["train", "test"]
+    )
+    for split, (X, y) in split_mapping.items():
+        pd.testing.assert_frame_equal(X, expected[split][0])
+        pd.testing.assert_series_equal(y, expected[split][1])
+
+
+def test_split_by_years_only_builds_requested_splits(processed):
+    df, columns = processed
+    assert list(data._split_by_years(df, columns, "cnt", [2011], ["test"])) == ["test"]
+
+
+def test_train_peak_memory(tmp_path):
+    config = {
+        "hyperparams": {
+            "selector": {},
+            "column_transformer": {},
+            "regressor": {"n_estimators": 5, "max_depth": 4},
+        },
+        "data": {"filepath": DATASET_PATH, "years_train": [2011]},
+        "metrics": [
+            {
+                "name": "bike demand error",
+                "params": {"understock_price": 0.7, "overstock_price": 0.3},
+            }
+        ],
+        "export": {"output_dir": str(tmp_path / "models")},
+    }
+    config_file = tmp_path / "config.yml"
+    config_file.write_text(yaml.safe_dump(config, sort_keys=False))
+    # A first run imports the libraries, which would count in the peak otherwise
+    app.train(str(config_file))
+
+    raw_size = pd.read_csv(DATASET_PATH).memory_usage(deep=True).sum()
+    tracemalloc.start()
+    try:
+        app.train(str(config_file))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # 5x, reached while the lagged features are computed
+    assert peak < 5.25 * raw_size
+
+
+def test_dataset_keeps_only_the_requested_split(tmp_path):
+    data_config = {"filepath": DATASET_PATH, "years_train": [2011]}
+    app._get_dataset(data_config, splits=["train"])
+    # A file not read yet, in case reads were cached
+    shutil.copy(DATASET_PATH, tmp_path / "timeseries.csv")
+    data_config["filepath"] = str(tmp_path / "timeseries.csv")
+
+    tracemalloc.start()
+    try:
+        split_mapping, _, _, _ = app._get_dataset(data_config, splits=["train"])
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    X, y = split_mapping["train"]
+    size = X.memory_usage(deep=True).sum() + y.memory_usage(deep=True)
+    # Neither the raw nor the processed frame stays alive
+    assert retained < 1.1 * size
+
+
+def _clean_like_baseline(df):
+    """Cleaning of a single series as first written, filling gaps row by row."""
+    df = df.copy()
+    df.index = data._get_timestamps(df)
+    df = df.reindex(pd.date_range(start=min(df.index), end=max(df.index), freq="1H"))
+    df = data._fix_date_columns(data._drop_columns_stage_1(df))
+    columns = ["season", "workingday", "weathersit", "temp", "atemp", "hum"]
+    columns += ["windspeed", "cnt"]
+    hour, day = datetime.timedelta(hours=1), datetime.timedelta(days=1)
+    gaps = df[df.isna().any(axis=1)].index
+    for idx in gaps:
+        if (idx - hour).dayofweek == idx.dayofweek:
+            similar_row = df.loc[idx - hour]
+        else:
+            similar_row = df.loc[idx + hour]
+        if similar_row.isna().any():
+            similar_row = df.loc[idx - day]
+        df.loc[idx, columns] = similar_row[columns]
+    for idx in gaps:
+        complete = df[
+            ~df.isna().any(axis=1) & (df.index.normalize() == idx.normalize())
+        ]
+        df.loc[idx, ["season", "holiday"]] = complete.iloc[0][["season", "holiday"]]
+    return df
+
+
+def _stations(raw, stations=3, seed=0):
+    """
+    Keyed copies of a single series with different counts and missing rows (a
+    whole day for one of them), shuffled.
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for station in range(stations):
+        df = raw.assign(station=station, cnt=raw["cnt"] + 1000 * station)
+        dropped = rng.choice(np.arange(1, len(df) - 1), size=20, replace=False)
+        df = df.drop(index=df.index[dropped])
+        if station == 1:
+            df = df[df["dteday"] != df["dteday"].iloc[len(df) // 2]]
+        frames.append(df)
+    keyed = pd.concat(frames, ignore_index=True)
+    return keyed.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+@pytest.fixture(scope="module")
+def raw():
+    return pd.read_csv(DATASET_PATH)
+
+
+def test_clean_dataset_matches_baseline(raw):
+    expected = _clean_like_baseline(raw)
+    pd.testing.assert_frame_equal(
+        data.clean_dataset(raw.copy()), expected, check_dtype=False, check_freq=False
+    )
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_keyed_series_are_processed_as_each_alone(raw, monkeypatch, parallel):
+    raw = raw.iloc[: 24 * 60]
+    keyed = _stations(raw)
+    if parallel:
+        monkeypatch.setattr(data, "PARALLEL_MIN_ROWS", 0)
+    df, *varnames = data._process_dataset(
+        keyed, key_column="station", n_jobs=2 if parallel else 1
+    )
+    assert df["station"].is_monotonic_increasing
+    for station, rows in keyed.groupby("station"):
+        expected, *expected_varnames = data._process_dataset(
+            rows.sort_values("instant").drop(columns="station")
+        )
+        assert varnames == expected_varnames
+        actual = df[df["station"] == station].drop(columns="station")
+        pd.testing.assert_frame_equal(
+            actual, expected, check_dtype=False, check_freq=False
+        )
+
+
+def _time_sorted(keyed, missing_days=(10, 11, 20, 27, 35, 44, 50)):
+    """Rows in time order, as a growing dataset is recorded, with days missing."""
+    keyed = keyed.assign(timestamp=data._get_timestamps(keyed))
+    days = np.sort(keyed["dteday"].unique())[list(missing_days)]
+    keyed = keyed[~keyed["dteday"].isin(days)]
+    keyed = keyed.sort_values(["timestamp", "station"])
+    return keyed.drop(columns="timestamp").reset_index(drop=True)
+
+
+def _sorted_by_key(X, y):
+    frame = X.assign(cnt=y).rename_axis("datetime").reset_index()
+    return frame.sort_values(["station", "datetime"], kind="stable").reset_index(
+        drop=True
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [500, 1777, 5000])
+def test_dataset_chunks_match_full_processing(raw, tmp_path, chunk_size):
+    keyed = _time_sorted(_stations(raw.iloc[: 24 * 90]))
+    assert len(keyed) > chunk_size
+    keyed.to_csv(tmp_path / "keyed.csv", index=False)
+    df, cnt, num, cat = data._process_dataset(keyed, key_column="station")
+    columns = data._get_feature_columns(cnt, num, cat, "station")
+
+    blocks = list(
+        data.iter_dataset_chunks(
+            pd.read_csv(tmp_path / "keyed.csv", chunksize=chunk_size),
+            key_column="station",
+        )
+    )
+    X = pd.concat([X for X, _ in blocks])
+    y = pd.concat([y for _, y in blocks])
+    pd.testing.assert_frame_equal(
+        _sorted_by_key(X, y),
+        _sorted_by_key(df[columns], df["cnt"]),
+        check_dtype=False,
+    )
+
+
+@pytest.mark.parametrize("output_file", ["predictions.csv", "predictions.parquet"])
+def test_score_matches_full_prediction(raw, tmp_path, output_file):
+    keyed = _time_sorted(_stations(raw.iloc[: 24 * 60]))
+    keyed.to_csv(tmp_path / "keyed.csv", index=False)
+    config = {
+        "hyperparams": {
+            "selector": {},
+            "column_transformer": {},
+            "regressor": {"n_estimators": 5, "max_depth": 4},
+        },
+        "data": {
+            "filepath": str(tmp_path / "keyed.csv"),
+            "years_train": [2011],
+            "key_column": "station",
+        },
+        "export": {"output_dir": str(tmp_path / "models")},
+        "score": {"chunk_size": 500, "jobs": 2},
+    }
+    config_file = tmp_path / "config.yml"
+    config_file.write_text(yaml.safe_dump(config, sort_keys=False))
+    version = app.train(str(config_file))
+
+    app.score(
+        str(config_file),
+        version,
+        str(tmp_path / "keyed.csv"),
+        str(tmp_path / output_file),
+        chunk_size=None,
+        jobs=None,
+    )
+    if output_file.endswith(".parquet"):
+        scored = pd.read_parquet(tmp_path / output_file)
+    else:
+        scored = pd.read_csv(tmp_path / output_file, parse_dates=["datetime"])
+
+    estimator = joblib.load(tmp_path / "models" / version / "model.joblib")
+    df, cnt, num, cat = data._process_dataset(keyed, key_column="station")
+    X = df[data._get_feature_columns(cnt, num, cat, "station")]
+    expected = pd.DataFrame(
+        {
+            "datetime": X.index,
+            "station": X["station"].to_numpy(),
+            "cnt": df["cnt"].to_numpy(),
+            "prediction": estimator.predict(X).astype(np.uint32),
+        }
+    )
+    scored = scored.sort_values(["station", "datetime"], kind="stable")
+    pd.testing.assert_frame_equal(
+        scored.reset_index(drop=True), expected, check_dtype=False
+    )
@@ -0,0 +1,121 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+import data
+from monitor import Monitor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEATHER_FEATURES = ("weathersit", "temp", "atemp", "hum", "windspeed")
+
+
+def _traffic(start, hours, seed, temp_shift=0.0):
+    """Hourly inputs whose weather follows the same distribution at any date."""
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range(start, periods=hours, freq="H")
+    return pd.DataFrame(
+        {
+            "season": (timestamps.month % 12) // 3 + 1,
+            "yr": timestamps.year - 2011,
+            "mnth": timestamps.month,
+            "hr": timestamps.hour,
+            "weekday": timestamps.weekday,
+            "holiday": (timestamps.dayofyear == 1).astype(int),
+            "temp": rng.normal(0.5, 0.1, hours) + temp_shift,
+            "hum": rng.uniform(0.2, 1.0, hours),
+        },
+        index=timestamps,
+    )
+
+
+def _log_lines(X):
+    return [
+        json.dumps(
+            {
+                "input": {"timestamp": str(timestamp), **row},
+                "pred": 100,
+            }
+        ).encode()
+        for timestamp, row in zip(X.index, X.to_dict("records"))
+    ]
+
+
+def _replay(X_reference, X_served):
+    monitor = Monitor.create(X_reference, reference_error=1.0)
+    lines = _log_lines(X_served)
+    # Read by the monitor command in batches as the log grows
+    for start in range(0, len(lines), 100):
+        batch = lines[start:][:100]
+        monitor.observe_predictions(batch, key_column=None)
+    return monitor.report(min_samples=100)
+
+
+def test_shifted_feature_flags_retraining():
+    report = _replay(
+        _traffic("2011-01-01", 24 * 365, seed=0),
+        _traffic("2012-01-01", 24 * 60, seed=1, temp_shift=0.2),
+    )
+    assert report["retrain"]
+    assert [reason.split()[0] for reason in report["reasons"]] == ["temp"]
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    split_mapping, _, _, _ = data.get_dataset(
+        lambda: pd.read_csv(os.path.join(REPO_DIR, "timeseries.csv")),
+        ["train", "test"],
+        [2011],
+    )
+    return split_mapping
+
+
+def _daily_reports(X_reference, X_served):
+    """Reports after each day of real traffic, with the shipped configuration."""
+    with open(os.path.join(REPO_DIR, "config.yml")) as file:
+        config = yaml.safe_load(file)["monitor"]
+    monitor = Monitor.create(
+        X_reference,
+        reference_error=1.0,
+        bins=config["bins"],
+        half_life=config["half_life"],
+        max_pending_hours=config["max_pending_hours"],
+    )
+    lines = _log_lines(X_served)
+    reports = []
+    for start in range(0, len(lines), 24):
+        monitor.observe_predictions(lines[start:][:24], key_column=None)
+        reports.append(
+            monitor.report(
+                error_tolerance=config["error_tolerance"],
+                drift_threshold=config["drift_threshold"],
+                min_samples=config["min_samples"],
+            )
+        )
+    return reports
+
+
+def _drifted(report, prefixes):
+    return any(reason.startswith(prefixes) for reason in report["reasons"])
+
+
+def test_training_year_replay_does_not_flag_retraining(dataset):
+    X_train, _ = dataset["train"]
+    reports = _daily_reports(X_train, X_train)
+    assert not any(report["retrain"] for report in reports)
+
+
+def test_next_year_replay_flags_demand_rather_than_weather(dataset):
+    # Demand grew by about 60% from 2011 to 2012, while the weather of each month
+    # is as in 2011 but for a warmer spring (February to April) and a more humid
+    # November
+    X_train, _ = dataset["train"]
+    X_test, _ = dataset["test"]
+    reports = _daily_reports(X_train, X_test)
+    weather = np.mean([_drifted(report, WEATHER_FEATURES) for report in reports])
+    demand = np.mean([_drifted(report, ("cnt_",)) for report in reports])
+    assert weather < 0.35
+    assert demand > 0.8